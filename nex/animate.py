@@ -21,36 +21,103 @@
 # system handling
 import os
 import glob
+import argparse
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # config file handling
 import toml
 
 # image processing
 from PIL import Image
-import matplotlib.pyplot as plt
 
 # data processing
-import pandas as pd
 import numpy as np
+import torch
 
 # utility files
 from model import inference
-from utils import geonexl1g, nex_utils
+from model import utils as model_utils
+from utils import geonexl1g, nex_utils, pipeline
+from utils.cache import ArrayCache
 
 # current directory
-w = os.path.join(os.path.dirname(__file__))
+w = os.path.dirname(os.path.abspath(__file__))
 
 # path for .toml configuration
-path = w+'config/config.toml'
+path = os.path.join(w, 'config/config.toml')
 
-def animate(path):
+# path for the model parameters
+config_file = os.path.join(w, 'model/params.yaml')
+
+def render_frame(f, data, h8_prediction, png_dir=None, preview=False, contrast=1.75, stretch='log'):
+    """Renders a single frame and optionally saves it to disk.
+
+    Args:
+        f (str): Path of the L1G file of the frame
+        data (np.array): L1G bands with blue first and red second
+        h8_prediction (np.array): Synthesized AHI green band, unused for previews
+        png_dir (str): Directory the image is saved to, the image is only returned if None
+        preview (bool): Approximate green from red, veggie and blue
+        contrast (float): Contrast enhancement factor
+        stretch (str): Colour stretch, 'log' for nex_utils.scale_rgb or 'gamma'
+
+    Returns:
+        t (str): Time of the frame
+        image (PIL.Image): Rendered frame
+    """
+
+    f_split = f.split('_')
+
+    # extract date
+    y = f_split[2][0:4]
+    m = f_split[2][4:6]
+    d = f_split[2][6:8]
+    t = f_split[3]
+
+    # get rgb
+    R = data[:,:,1:2]
+    B = data[:,:,0:1]
+
+    if preview:
+        # hybrid green from red, veggie and blue
+        G = 0.45 * R + 0.1 * data[:,:,2:3] + 0.45 * B
+    else:
+        # scaling AHI closer to true green
+        G = h8_prediction[:,:,0:1]
+        F = 0.05
+        G = G * F + (1-F) * R
+
+    if stretch == 'log':
+        # logarithmic stretch of reflectances scaled by 10000
+        virtual_rgb = nex_utils.scale_rgb(R, G, B, scale=10000.)
+    else:
+        # assemble virtual rgb image and scale
+        virtual_rgb = np.concatenate([R, G, B], axis=2)
+        virtual_rgb[virtual_rgb < 0.] = 0
+        virtual_rgb /= 1.6
+
+    # make color enhanced image
+    image = nex_utils.render_rgb(virtual_rgb, label=y+"-"+m+"-"+d+" "+t, contrast=contrast)
+
+    if png_dir is not None:
+        # parse file name
+        name = f_split[0].split('/')
+        name = name[5]+'_'+name[7]+'_'+name[8]+'_'+name[9]+t
+
+        image.save(os.path.join(png_dir, name+'.png'), compress_level=1)
+    return t, image
+
+def animate(path, processes=1):
     """Loads satellite collection for animation process.
 
     Args:
         path (str): A path to a dictionary of remote sensing data (.toml file)
+        processes (int): Number of sections animated in parallel
 
     Returns:
-        image (object): An series of .png images at discrete intervals
+        image (object): An animation per section
 
     Examples:
         >>> animate('config/config.toml')
@@ -59,103 +126,259 @@ def animate(path):
     # read satellite data file
     sat = toml.load(path)
 
-    for key in sat.keys():
-        L1G_directory = sat[key].get('collection')   # satellite collection to retrieve
-        sensor = sat[key].get('sensor')              # corresponding sensor
-        tile = sat[key].get('tile')                  # tile of interest
-        year = sat[key].get('year')                  # year of interest
-        doys = sat[key].get('doys')                  # day range to retrieve (exclusive)
-        hours = sat[key].get('hours')                # hour of interest
-        frames = sat[key].get('frames')              # duration
-        remove = sat[key].get('remove')              # remove resultant png images
-        file_name = sat[key].get('name')             # output file name
-
-        # convert string to booelan
-        str_bool = lambda x: True if x.lower()=='true' else False
-        remove = str_bool(remove)
-
-        # model checkpoint file
-        config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),'model/params.yaml')
-        model, _ = inference.load_model(config_file)
-
-        # retrieve tiles
-        files = []
-        geo = geonexl1g.GeoNEXL1G(L1G_directory, sensor)
-        for doy in range(doys[0],doys[1]): files.append(geo.files(tile=tile, year=year, dayofyear=doy))
-        files = pd.concat(files)
-
-        # check if empty collection
-        if files.shape[0] == 0:
-            print("The requested satellite overpass data is not available.")
-            continue
-
-        files = files.sort_values(['dayofyear','hour','minute'])
-        files = files[(files['hour'] >= hours[0]) & (files['hour'] <= hours[1])]
-
-        count = 0
-        for i, row in files.iterrows():
-            f = row['file']
-            f_split = f.split('_')
-
-            # extract date
-            y = f_split[2][0:4]
-            m = f_split[2][4:6]
-            d = f_split[2][6:8]
-            t = f_split[3]
-
-            # iterate counter
-            count = count + 1
-            print(str(count)+": processing: "+t)
-
-            # read file
-            dataobj = geonexl1g.L1GFile(f, resolution_km=1.)
-            data = dataobj.load()
+    if processes <= 1:
+        for key in sat.keys():
+            animate_section(key, sat[key])
+        return
+
+    # the model checkpoint is loaded once and shared by the sections of a process. Forked CPU
+    # workers inherit a model loaded here, CUDA cannot be used in a forked child so workers
+    # are spawned and load it once each, as they would with any other start method.
+    fork = not torch.cuda.is_available() and 'fork' in multiprocessing.get_all_start_methods()
+    if fork:
+        inference.get_model(config_file)
+    context = multiprocessing.get_context('fork' if fork else 'spawn')
+
+    # sections are independent events, each rendering into its own directory
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                             initargs=(processes,)) as executor:
+        futures = [executor.submit(animate_section, key, sat[key]) for key in sat.keys()]
+        for future in futures:
+            future.result()
+
+def _init_worker(processes):
+    # share the cores between the section processes
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // processes))
+    inference.get_model(config_file)
+
+def animate_section(key, section):
+    """Animates a single configuration section.
 
-            # translate domains
-            h8_prediction = inference.domain_to_domain(model, data, sensor, 'H8')
-
-            # get rgb
-            R = data[:,:,1:2]
-            G = h8_prediction[:,:,1:2]
-            B = data[:,:,0:1]
-
-            # scaling AHI closer to true green
-            F = 0.05
-            G = G * F + (1-F) * R
-
-            #virtual_rgb = nex_utils.scale_rgb(R,G,B)
-
-            # assemble virtual rgb image and scale
-            virtual_rgb = np.concatenate([R, G, B], axis=2)
-            virtual_rgb[virtual_rgb < 0.] = 0
-            virtual_rgb /= 1.6
-
-            # make and save image to disk
-            fig = plt.figure(figsize=(10,10))
-            ax = fig.add_subplot(111)
-            plt.imshow(virtual_rgb**0.5)
-            ax.text(0.95, 0.01, y+"-"+m+"-"+d+" "+t,
-            verticalalignment='bottom', horizontalalignment='right',
-            transform=ax.transAxes,
-            color='white', fontsize=20)
-
-            plt.axis('off')
-            plt.tight_layout()
-
-            # parse file name
-            name = f_split[0].split('/')
-            name = name[5]+'_'+name[7]+'_'+name[8]+'_'+name[9]+t
-
-            plt.savefig(w+'images/{}'.format(name))
-            plt.close()
-
-        # apply color enhancement
-        nex_utils.color_fix()
-
-        # convert .png images to .gif file
-        nex_utils.make_gif(file_name)
+    Args:
+        key (str): Name of the section, e.g. ANIMATE1
+        section (dict): Options of the section
 
-        # remove .png files if desired
-        if remove: nex_utils.empty_dir()
+    Returns:
+        image (object): An animation, and .png images at discrete intervals unless removed
+    """
 
-animate(path)
+    model, params = inference.get_model(config_file)
+
+    L1G_directory = section.get('collection')                    # satellite collection to retrieve
+    sensor = section.get('sensor')                               # corresponding sensor
+    tile = section.get('tile')                                   # tile or list of tiles of interest
+    bbox = section.get('bbox')                                   # [west, south, east, north] of a mosaic
+    year = section.get('year')                                   # year of interest
+    doys = section.get('doys')                                   # day range to retrieve (exclusive)
+    hours = section.get('hours')                                 # hour of interest
+    frames = section.get('frames')                               # duration
+    remove = section.get('remove')                               # do not keep png images
+    file_name = section.get('name')                              # output file name
+    batch_size = section.get('batch_size', 4)                    # frames per inference pass
+    patch_size = section.get('patch_size')                       # tiled inference patch size
+    overlap = section.get('overlap', 48)                         # tiled inference patch overlap
+    workers = section.get('workers', 1)                          # processes reading files
+    render_workers = section.get('render_workers', 1)            # threads rendering frames
+    queue_depth = section.get('queue_depth', 2*batch_size)       # frames in flight per stage
+    cache_dir = section.get('cache')                             # decoded frame cache directory
+    cache_gb = section.get('cache_gb')                           # decoded frame cache size cap
+    prediction_cache_dir = section.get('prediction_cache')       # prediction cache directory
+    prediction_cache_gb = section.get('prediction_cache_gb')     # prediction cache size cap
+    prediction_cache_days = section.get('prediction_cache_days') # prediction cache entry lifetime
+    file_index = section.get('file_index')                       # persistent file index path
+    contrast = section.get('contrast', 1.75)                     # contrast enhancement factor
+    stretch = section.get('stretch', 'log')                      # colour stretch, log or gamma
+    preview = section.get('preview', 'False')                    # quick-look without the model
+    reuse_palette = section.get('reuse_palette', 'False')        # one gif palette for all frames
+    output_format = section.get('format', 'gif')                 # gif, mp4, webm, webp or apng
+    fps = section.get('fps', 10)                                 # frames per second
+    quality = section.get('quality')                             # encoder quality from 0 to 100
+    ffmpeg = section.get('ffmpeg', 'ffmpeg')                     # ffmpeg executable
+    L1G_directory2 = section.get('collection2')                  # overlapping collection to composite
+    sensor2 = section.get('sensor2')                             # corresponding sensor
+    tolerance = section.get('tolerance', 5)                      # largest scan time difference (min)
+
+    # convert string to booelan
+    str_bool = lambda x: True if str(x).lower()=='true' else False
+    remove = str_bool(remove)
+    preview = str_bool(preview)
+    reuse_palette = str_bool(reuse_palette)
+
+    # per-section image directory so sections can run concurrently, frames
+    # which are removed afterwards are never written
+    png_dir = None
+    if not remove:
+        png_dir = os.path.join(w, 'images', key)
+        os.makedirs(png_dir, exist_ok=True)
+
+    # bands to read, previews only need blue, red and veggie
+    bands = [1, 2, 3] if preview else inference.input_bands()
+
+    # overlap composites pair every frame with the nearest scan of a second sensor
+    composite = L1G_directory2 is not None
+
+    # mosaics assemble the frames of several tiles scanned at the same time
+    mosaic = bbox is not None or isinstance(tile, (list, tuple))
+    if mosaic:
+        if composite:
+            raise ValueError(f'Section {key} cannot be both a mosaic and an overlap composite')
+        tile = geonexl1g.bbox_tiles(bbox) if bbox is not None else list(tile)
+
+    # retrieve tiles
+    index = geonexl1g.FileIndex(file_index) if file_index else None
+    if composite:
+        paired = geonexl1g.L1GPaired(L1G_directory, L1G_directory2, sensor, sensor2)
+        files = paired.catalog(tile=tile, year=year, days=doys, hours=hours, tolerance=tolerance, index=index)
+    else:
+        geo = geonexl1g.GeoNEXL1G(L1G_directory, sensor)
+        files = geo.catalog(tile=tile, year=year, days=doys, hours=hours, index=index)
+
+    # check if empty collection
+    if files.shape[0] == 0:
+        print("The requested satellite overpass data is not available.")
+        return
+
+    # a translation pass covers every tile of a timestamp
+    frames_per_item = len(tile) if mosaic else 1
+    model_batch_size = max(batch_size, frames_per_item)
+
+    # mosaics are translated whole, in patches of a tile which only keep the pixels that do
+    # not see the zero padding at the patch border, so tile edges inside the mosaic leave no seam
+    mosaic_patch_size = mosaic_overlap = None
+    if mosaic:
+        mosaic_patch_size = patch_size or geonexl1g.L1GFile(files['file'].iloc[0], resolution_km=1.).resolution_size
+        mosaic_overlap = max(overlap, 2 * model_utils.receptive_radius(params))
+
+    # read files concurrently
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    renderers = ThreadPoolExecutor(render_workers)
+
+    # reuse frames decoded by earlier runs
+    frame_cache = None
+    if cache_dir:
+        max_bytes = int(cache_gb * 2**30) if cache_gb else None
+        frame_cache = ArrayCache(cache_dir, max_bytes=max_bytes)
+
+    # reuse predictions of earlier runs
+    prediction_cache = None
+    if prediction_cache_dir:
+        max_bytes = int(prediction_cache_gb * 2**30) if prediction_cache_gb else None
+        max_age = prediction_cache_days * 86400 if prediction_cache_days else None
+        prediction_cache = ArrayCache(prediction_cache_dir, max_bytes=max_bytes, max_age=max_age)
+
+    def predict(frames, source):
+        if mosaic:
+            return [inference.tiled_domain_to_domain(model, data, source, 'H8', bands2=[1],
+                                                     patch_size=mosaic_patch_size, overlap=mosaic_overlap,
+                                                     batch_size=model_batch_size)
+                    for data in frames]
+        if patch_size:
+            return [inference.tiled_domain_to_domain(model, data, source, 'H8', bands2=[1],
+                                                     patch_size=patch_size, overlap=overlap,
+                                                     batch_size=model_batch_size)
+                    for data in frames]
+        return inference.batch_domain_to_domain(model, frames, source, 'H8', bands2=[1],
+                                                batch_size=model_batch_size)
+
+    def frame_key(f):
+        # identity of the frame of a file, or of the tiles of a mosaic
+        if isinstance(f, tuple):
+            return tuple(None if t is None else frame_key(t) for t in f)
+        return geonexl1g.L1GFile(f, bands=bands, resolution_km=1.).cache_key()
+
+    def translate_sensor(files, frames, source):
+        if prediction_cache is None:
+            return predict(frames, source)
+        keys = [inference.prediction_key(frame_key(f), source, 'H8', params, bands2=[1],
+                                         patch_size=mosaic_patch_size or patch_size,
+                                         overlap=mosaic_overlap or overlap)
+                for f in files]
+        return inference.cached_translate(functools.partial(predict, source=source), frames, keys,
+                                          prediction_cache)
+
+    def translate(files, frames):
+        # translate domains
+        if preview:
+            return [None] * len(frames)
+        if not composite:
+            return translate_sensor(files, frames, sensor)
+        # one batch per sensor as each has its own encoder
+        predictions1 = translate_sensor([f[0] for f in files], [d[0] for d in frames], sensor)
+        predictions2 = translate_sensor([f[1] for f in files], [d[1] for d in frames], sensor2)
+        return list(zip(predictions1, predictions2))
+
+    # frames are encoded as they are rendered
+    writer = nex_utils.open_writer(file_name, format=output_format, fps=fps, quality=quality,
+                                   reuse_palette=reuse_palette, ffmpeg=ffmpeg)
+
+    count = 0
+    def sink(frame):
+        nonlocal count
+        t, image = frame
+        writer.append(image)
+
+        # iterate counter
+        count = count + 1
+        print(str(count)+": processing: "+t)
+
+    # stream files through reading, translation and rendering
+    load = functools.partial(geonexl1g.load_file, bands=bands, resolution_km=1., cache=frame_cache)
+    render = functools.partial(render_frame, png_dir=png_dir, preview=preview, contrast=contrast,
+                               stretch=stretch)
+    items = files['file1'] if composite else files['file']
+
+    if mosaic:
+        # the tiles are assembled on the grid when loaded, frames are named after their first tile
+        render_single = render
+
+        def render(tile_files, data, prediction):
+            return render_single(next(f for f in tile_files if f is not None), data, prediction)
+
+        load = functools.partial(geonexl1g.load_mosaic, tiles=tile, bands=bands, resolution_km=1.,
+                                 cache=frame_cache)
+        items = geonexl1g.mosaic_files(files, tile)
+
+    if composite:
+        # blend both sensors by their viewing angle before rendering
+        size = geonexl1g.L1GFile(files['file1'].iloc[0], resolution_km=1.).resolution_size
+        pair_tiles = dict(zip(files['file1'], files.index.get_level_values('tile')))
+        tile_weights = {}
+        render_single = render
+
+        def render(pair, frames, predictions):
+            pair_tile = pair_tiles[pair[0]]
+            if pair_tile not in tile_weights:
+                tile_weights[pair_tile] = geonexl1g.view_weights(pair_tile, [sensor, sensor2], size)
+            weights = tile_weights[pair_tile]
+            data = nex_utils.blend(frames, weights)
+            prediction = None if preview else nex_utils.blend(predictions, weights)
+            return render_single(pair[0], data, prediction)
+
+        load = functools.partial(geonexl1g.load_files, bands=bands, resolution_km=1., cache=frame_cache)
+        items = list(zip(items, files['file2']))
+
+    # single frames loaded in this process are read into a recycled ring of buffers, cache hits
+    # are served memory-mapped instead and process pools return their own arrays
+    buffers = None
+    stream_batch_size = max(1, batch_size // frames_per_item)
+    if not (mosaic or composite) and executor is None and frame_cache is None:
+        size = geonexl1g.L1GFile(items.iloc[0], resolution_km=1.).resolution_size
+        buffers = [np.empty((size, size, len(bands)), dtype=np.float32)
+                   for _ in range(queue_depth + stream_batch_size)]
+
+    try:
+        pipeline.stream(items, load, translate, render, sink, load_executor=executor,
+                        render_executor=renderers, batch_size=stream_batch_size, depth=queue_depth,
+                        buffers=buffers)
+    finally:
+        writer.close()
+        if executor is not None: executor.shutdown()
+        renderers.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Animate GeoNEX L1G collections')
+    parser.add_argument('config', nargs='?', default=path, help='path to a .toml configuration file')
+    parser.add_argument('--processes', type=int, default=1, help='number of sections animated in parallel')
+    args = parser.parse_args()
+
+    animate(args.config, processes=args.processes)
@@ -0,0 +1,149 @@
+'''
+Export the encoder -> shared -> decoder pipeline of SplitGenVAE for a single domain pair to a
+frozen TorchScript (or ONNX) artifact which can be loaded without network.py/unit_networks.py.
+
+    python -m model.export G17 H8 --bands2 1 --output model/g17_h8.pt
+'''
+import argparse
+import copy
+
+import numpy as np
+import torch
+from torch import nn
+
+from . import utils
+from .fusion import fuse_model
+from .inference import load_model
+
+def _select_out_channels(block, channels):
+    # copy of a conv block which only computes the selected output channels
+    block = copy.deepcopy(block)
+    conv = block.conv
+    conv.weight = nn.Parameter(conv.weight.detach()[channels])
+    if conv.bias is not None:
+        conv.bias = nn.Parameter(conv.bias.detach()[channels])
+    conv.out_channels = len(channels)
+    return block
+
+class DomainTranslator(nn.Module):
+    '''
+    Fixed translation from domain1 to domain2 including normalization and thermal restrictions.
+    Takes raw inputs of shape (N,H,W,len(bands1)) and returns predictions of shape
+    (N,H,W,len(bands2)), matching inference.batch_domain_to_domain.
+    Args:
+        model (SplitGenVAE): pytorch module
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+    '''
+    def __init__(self, model, domain1, domain2, bands1=None, bands2=None):
+        super(DomainTranslator, self).__init__()
+        if bands1 is None:
+            bands1 = np.arange(0,16)
+        if bands2 is None:
+            bands2 = np.arange(0,16)
+        bands1, bands2 = np.asarray(bands1), np.asarray(bands2)
+
+        self.encoder = model.encoders[domain1]
+        self.shared = model.shared
+        decoder = model.decoders[domain2]
+        self.skip_dim = model.skip_dim
+        if self.skip_dim:
+            self.inner, conv_out = decoder.inner_model, decoder.conv_out
+        else:
+            self.inner, conv_out = decoder.model[:-1], decoder.model[-1]
+        if not np.array_equal(bands2, np.arange(decoder.output_dim)):
+            conv_out = _select_out_channels(conv_out, bands2)
+        self.conv_out = conv_out
+
+        mu1, std1 = utils.get_sensor_stats(domain1)
+        mu2, std2 = utils.get_sensor_stats(domain2)
+        self.register_buffer('mu1', torch.tensor(np.array(mu1)[bands1], dtype=torch.float32))
+        self.register_buffer('std1', torch.tensor(np.array(std1)[bands1], dtype=torch.float32))
+        self.register_buffer('mu2', torch.tensor(np.array(mu2)[bands2], dtype=torch.float32))
+        self.register_buffer('std2', torch.tensor(np.array(std2)[bands2], dtype=torch.float32))
+        self.register_buffer('thermal', torch.tensor(bands2 >= 6))
+
+    def forward(self, x):
+        x = ((x - self.mu1) / self.std1).permute(0,3,1,2)
+        x_inner = self.inner(self.shared(self.encoder(x)))
+        if self.skip_dim:
+            x_inner = torch.cat([x_inner, x[:,self.skip_dim]], 1)
+        estimate = self.conv_out(x_inner).float()
+        estimate = estimate.permute(0,2,3,1) * self.std2 + self.mu2
+
+        # place some restrictions on thermal ranges
+        invalid = self.thermal & ((estimate < 180) | (estimate > 350))
+        return estimate.masked_fill(invalid, float('nan'))
+
+def export(model, domain1, domain2, output, bands1=None, bands2=None, size=64, onnx=False):
+    '''
+    Trace and save a DomainTranslator
+    Args:
+        model (SplitGenVAE): pytorch module
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        output (str): Path of the saved artifact
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+        size (int): Height and width of the example input used for tracing
+        onnx (boolean): Export ONNX instead of TorchScript, default False
+    '''
+    translator = DomainTranslator(fuse_model(model), domain1, domain2, bands1=bands1, bands2=bands2)
+    save(translator.cpu().float(), output, size=size, onnx=onnx)
+
+def save(translator, output, size=64, onnx=False):
+    '''
+    Trace and save a translation module taking inputs of shape (N,H,W,C)
+    Args:
+        translator (torch.nn.Module): e.g. DomainTranslator
+        output (str): Path of the saved artifact
+        size (int): Height and width of the example input used for tracing
+        onnx (boolean): Export ONNX instead of TorchScript, default False
+    '''
+    translator = translator.eval()
+    example = translator.mu1.expand(1, size, size, -1).contiguous()
+
+    if onnx:
+        torch.onnx.export(translator, example, output, input_names=['x'], output_names=['estimate'],
+                          dynamic_axes={'x': {0: 'n', 1: 'h', 2: 'w'}, 'estimate': {0: 'n', 1: 'h', 2: 'w'}})
+        return
+
+    with torch.inference_mode():
+        traced = torch.jit.trace(translator, example)
+    traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, output)
+
+def load_exported(path, device=None):
+    '''
+    Load a TorchScript DomainTranslator, does not require the model classes
+    Args:
+        path (str): Path of the saved artifact
+        device: set device for inference
+    Return:
+        torch.jit.ScriptModule
+    '''
+    if device is None:
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    return torch.jit.load(path, map_location=device)
+
+def _parse_bands(bands):
+    if bands is None:
+        return None
+    return [int(b) for b in bands.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a SplitGenVAE domain translation')
+    parser.add_argument('domain1', help='data domain (G16,G17,H8)')
+    parser.add_argument('domain2', help='target domain (G16,G17,H8)')
+    parser.add_argument('--config', default='model/params.yaml', help='model configuration file')
+    parser.add_argument('--bands1', help='comma separated input band indices')
+    parser.add_argument('--bands2', help='comma separated output band indices')
+    parser.add_argument('--output', required=True, help='path of the saved artifact')
+    parser.add_argument('--onnx', action='store_true', help='export ONNX instead of TorchScript')
+    args = parser.parse_args()
+
+    model, _ = load_model(args.config, device='cpu')
+    export(model, args.domain1, args.domain2, args.output, bands1=_parse_bands(args.bands1),
+           bands2=_parse_bands(args.bands2), onnx=args.onnx)
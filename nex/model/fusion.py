@@ -0,0 +1,62 @@
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from .unit_networks import Conv2dBlock
+
+class FusedConv2dBlock(nn.Module):
+    '''
+    Inference-only replacement for a zero padded Conv2dBlock without normalization. The zero
+    padding is folded into the convolution and the empty normalization branch is dropped, so no
+    padded copy of the feature map is materialized and conv + activation are adjacent ops that
+    graph compilers can fuse.
+    Args:
+        block (Conv2dBlock): block to fuse, its parameters are shared, not copied
+    '''
+    def __init__(self, block):
+        super(FusedConv2dBlock, self).__init__()
+        conv = block.conv
+        self.conv = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride,
+                              padding=block.pad.padding[0], dilation=conv.dilation, groups=conv.groups,
+                              bias=conv.bias is not None)
+        self.conv.weight = conv.weight
+        self.conv.bias = conv.bias
+        self.activation = block.activation
+
+    def forward(self, x):
+        x = self.conv(x)
+        if self.activation:
+            x = self.activation(x)
+        return x
+
+    def forward_channels(self, x, channels):
+        # convolve with a subset of the output filters
+        channels = torch.as_tensor(channels, dtype=torch.long, device=self.conv.weight.device)
+        weight = self.conv.weight.index_select(0, channels)
+        bias = self.conv.bias.index_select(0, channels) if self.conv.bias is not None else None
+        x = F.conv2d(x, weight, bias, self.conv.stride, self.conv.padding,
+                     self.conv.dilation, self.conv.groups)
+        if self.activation:
+            x = self.activation(x)
+        return x
+
+def _is_fusable(block):
+    padding = block.pad.padding
+    return (isinstance(block.pad, nn.ZeroPad2d) and block.norm is None
+            and len(set(padding)) == 1)
+
+def fuse_model(model):
+    '''
+    Replace every fusable Conv2dBlock in model with a FusedConv2dBlock, in place. The result
+    matches the original model to numerical tolerance and is only meant for inference.
+    Args:
+        model (torch.nn.Module): e.g. SplitGenVAE
+    Returns:
+        torch.nn.Module: the same model
+    '''
+    for name, child in model.named_children():
+        if isinstance(child, Conv2dBlock) and _is_fusable(child):
+            setattr(model, name, FusedConv2dBlock(child))
+        else:
+            fuse_model(child)
+    return model
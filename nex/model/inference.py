@@ -1,10 +1,105 @@
 import os
+import functools
+import hashlib
+import itertools
+import threading
 
 import numpy as np
 import torch
 
 from .network import SplitGenVAE
 from . import utils
+from .fusion import fuse_model
+
+# models shared by every caller in this process, keyed by (config file, device, dtype)
+_models = dict()
+_models_lock = threading.Lock()
+
+def _sensor_stats(domain, bands):
+    '''
+    Normalization statistics for a subset of bands, shaped to broadcast over (N,H,W,C)
+    '''
+    mu, std = utils.get_sensor_stats(domain)
+    return np.array(mu, dtype=np.float32)[bands], np.array(std, dtype=np.float32)[bands]
+
+def _translate(model, data, domain1, domain2, bands1, bands2, device):
+    '''
+    Translate a batch of frames of shape (N,H,W,C) from domain1 to domain2
+
+    Returns:
+        np.array of target prediction with shape (N,H,W,len(bands2))
+        torch.Tensor of latent features with shape (N,C,H,W)
+    '''
+    # get statistics for normalization
+    mu1, std1 = _sensor_stats(domain1, bands1)
+    mu2, std2 = _sensor_stats(domain2, bands2)
+
+    # normalize inputs, move channels first, send to device
+    data_norm = (data[..., bands1] - mu1) / std1
+    data_norm = np.transpose(data_norm, (0,3,1,2))
+    dtype = next(model.parameters()).dtype
+    data_norm = torch.as_tensor(data_norm, dtype=dtype, device=device)
+
+    with torch.inference_mode():
+        # encode to latent space, skipping the unused noise sample
+        z, _ = model.encode(data_norm, domain1, noise=False)
+
+        skip_x = None
+        if model.skip_dim:
+            skip_x = data_norm[:,model.skip_dim]
+
+        # decode to target domain, only computing the requested bands
+        out_bands = bands2
+        if np.array_equal(bands2, np.arange(model.decoders[domain2].output_dim)):
+            out_bands = None
+        estimate = model.decode(z, domain2, skip_x=skip_x, bands=out_bands).float().cpu().numpy()
+    estimate = np.transpose(estimate, (0,2,3,1))
+    # de-normalize target
+    estimate = estimate * std2 + mu2
+
+    # place some restrictions on thermal ranges
+    thermal_bands = np.flatnonzero(bands2 >= 6)
+    if len(thermal_bands):
+        thermal = estimate[..., thermal_bands]
+        thermal[(thermal < 180) | (thermal > 350)] = np.nan
+        estimate[..., thermal_bands] = thermal
+    return estimate, z
+
+def _batches(frames, batch_size):
+    # stacked arrays are sliced without copying, other iterables are stacked per batch
+    if isinstance(frames, np.ndarray):
+        for i in range(0, len(frames), batch_size):
+            yield frames[i:i+batch_size]
+        return
+    frames = iter(frames)
+    while True:
+        batch = list(itertools.islice(frames, batch_size))
+        if not batch:
+            return
+        yield np.stack(batch)
+
+def _select_bands(bands1, bands2):
+    if bands1 is None:
+        bands1 = np.arange(0,16)
+    if bands2 is None:
+        bands2 = np.arange(0,16)
+    return np.asarray(bands1), np.asarray(bands2)
+
+def _get_device(device):
+    if device is None:
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    return device
+
+def input_bands(bands1=None):
+    '''
+    L1G band numbers read by a translation, e.g. to only load these with geonexl1g.L1GFile
+    Args:
+        bands1 (list or np.array): Indices of bands to select as inputs
+    Returns:
+        list of band numbers starting at 1
+    '''
+    bands1, _ = _select_bands(bands1, None)
+    return [int(b) + 1 for b in bands1]
 
 def domain_to_domain(model, data, domain1, domain2, bands1=None, bands2=None, device=None,
                      latent=False):
@@ -24,58 +119,166 @@ def domain_to_domain(model, data, domain1, domain2, bands1=None, bands2=None, de
         np.array of target prediction
         (optional) np.array of latent features
     '''
-    if device is None:
-        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    device = _get_device(device)
+    bands1, bands2 = _select_bands(bands1, bands2)
 
-    # get statistics for normalization
-    mu1, std1 = utils.get_sensor_stats(domain1)
-    mu2, std2 = utils.get_sensor_stats(domain2)
+    estimate, z = _translate(model, data[np.newaxis], domain1, domain2, bands1, bands2, device)
 
-    # select bands
-    if bands1 is None:
-        bands1 = np.arange(0,16)
-    if bands2 is None:
-        bands2 = np.arange(0,16)
+    if latent:
+        return estimate[0], z.float().cpu().numpy()[0]
+    return estimate[0]
 
-    data = data[:,:,bands1]
-    mu1 = np.array(mu1)[bands1]
-    std1 = np.array(std1)[bands1]
-
-    mu2 = np.array(mu2)[bands2]
-    std2 = np.array(std2)[bands2]
-
-    # normalize inputs, add axis, send to device
-    data_norm = (data - mu1) / std1
-    data_norm = np.transpose(data_norm, (2,0,1))[np.newaxis]
-    data_norm = torch.Tensor(data_norm).to(device)
-
-    # encode to latent space
-    z, noise = model.encode(data_norm, domain1)
-    
-    skip_x = None
-    if model.skip_dim:
-        skip_x = data_norm[:,model.skip_dim]
-    
-    # decode to target domain
-    estimate = model.decode(z, domain2, skip_x=skip_x)[0].detach().cpu().numpy() # decode to bands
-    estimate = np.transpose(estimate, (1,2,0))
-    # de-normalize target
-    estimate = estimate * std2 + mu2
+def iter_domain_to_domain(model, frames, domain1, domain2, bands1=None, bands2=None, device=None,
+                          batch_size=8):
+    '''
+    Translate a sequence of frames from domain1 to domain2 in mini-batches
 
-    # place some restrictions on thermal ranges
-    thermal_bands = bands2[bands2 >= 6]
-    thermal = estimate[:,:,thermal_bands]
-    thermal[thermal < 180] = np.nan
-    thermal[thermal > 350] = np.nan
-    estimate[:,:,thermal_bands] = thermal
+    Args:
+        model (SplitGenVAE): pytorch module
+        frames (np.array or iterable): Array of shape (N,H,W,C) or iterable of (H,W,C) arrays
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+        device (str): which device to load data into
+        batch_size (int): Number of frames per forward pass, default 8
+    Yields:
+        np.array of target prediction for each frame, in input order
+    '''
+    device = _get_device(device)
+    bands1, bands2 = _select_bands(bands1, bands2)
 
-    if latent:
-        return estimate, z.detach().cpu().numpy()[0]
-    return estimate
+    for batch in _batches(frames, batch_size):
+        estimate, _ = _translate(model, batch, domain1, domain2, bands1, bands2, device)
+        for e in estimate:
+            yield e
+
+def batch_domain_to_domain(model, frames, domain1, domain2, bands1=None, bands2=None, device=None,
+                           batch_size=8):
+    '''
+    Translate a stack of frames from domain1 to domain2 in mini-batches
+
+    Args:
+        model (SplitGenVAE): pytorch module
+        frames (np.array or iterable): Array of shape (N,H,W,C) or iterable of (H,W,C) arrays
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+        device (str): which device to load data into
+        batch_size (int): Number of frames per forward pass, default 8
+    Returns:
+        np.array of target predictions with shape (N,H,W,C)
+    '''
+    return np.stack(list(iter_domain_to_domain(model, frames, domain1, domain2, bands1=bands1,
+                                               bands2=bands2, device=device, batch_size=batch_size)))
+
+def tiled_domain_to_domain(model, data, domain1, domain2, bands1=None, bands2=None, device=None,
+                           patch_size=256, overlap=48, batch_size=8, margin=None):
+    '''
+    Translate a large frame from domain1 to domain2 patch by patch, blending overlapping
+    patches with feathered weights. Peak memory is bounded by patch_size and batch_size
+    rather than the size of the frame. The inner margin pixels of each patch, which see the
+    zero padding at the patch border, are discarded; with a margin of at least the receptive
+    radius of the model (utils.receptive_radius) the result matches the translation of the
+    whole frame.
+
+    Args:
+        model (SplitGenVAE): pytorch module
+        data (np.array): Array of shape (H,W,C)
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+        device (str): which device to load data into
+        patch_size (int): Size of square patches, default 256
+        overlap (int): Number of pixels shared by neighbouring patches, default 48
+        batch_size (int): Number of patches per forward pass, default 8
+        margin (int): Border pixels of each patch to discard, at most overlap/2, default
+            min(utils.receptive_radius(model.params), overlap//2)
+    Returns:
+        np.array of target prediction
+    '''
+    if margin is None:
+        margin = min(utils.receptive_radius(model.params), overlap // 2)
+    utils.check_patches(patch_size, overlap, margin)
+
+    h, w = data.shape[:2]
+    if h <= patch_size and w <= patch_size:
+        return domain_to_domain(model, data, domain1, domain2, bands1=bands1, bands2=bands2,
+                                device=device)
+    patch_size = min(patch_size, h, w)
+    overlap = min(overlap, patch_size - 1)
+    margin = min(margin, overlap // 2)
+
+    # patches are stacked one batch at a time
+    patches = utils.iter_patches(data, patch_size, overlap)
+    estimates = iter_domain_to_domain(model, patches, domain1, domain2, bands1=bands1, bands2=bands2,
+                                      device=device, batch_size=batch_size)
+    return utils.stitch_patches(estimates, (h, w), patch_size, overlap, margin)
+
+def cached_translate(translate, frames, keys, cache, dtype=np.float16):
+    '''
+    Serve predictions from a persistent cache, only translating frames which are not cached
+    Args:
+        translate (callable): Maps a list of frames to a list of predictions,
+            e.g. a partial of batch_domain_to_domain
+        frames (list): Frames of shape (H,W,C)
+        keys (list): Cache key of each frame's prediction, see prediction_key
+        cache (ArrayCache): Prediction cache
+        dtype: Type the predictions are stored as, default np.float16
+    Returns:
+        list of float32 np.array of target predictions in the order of frames, rounded to dtype
+        whether they were cached or not
+    '''
+    predictions = [cache.get(k) for k in keys]
+    missing = [i for i, p in enumerate(predictions) if p is None]
+    if missing:
+        estimates = translate([frames[i] for i in missing])
+        for i, estimate in zip(missing, estimates):
+            predictions[i] = cache.put(keys[i], estimate.astype(dtype))
+    return [np.asarray(p, dtype=np.float32) for p in predictions]
+
+def prediction_key(frame_key, domain1, domain2, params, bands1=None, bands2=None, **options):
+    '''
+    Cache key of a prediction
+    Args:
+        frame_key: Identity of the input frame, e.g. geonexl1g.L1GFile.cache_key()
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        params (dict): Model parameters, the checkpoint they point to is hashed into the key
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+        options: Other settings changing the prediction, e.g. patch_size
+    Returns:
+        tuple
+    '''
+    bands1, bands2 = _select_bands(bands1, bands2)
+    return (frame_key, domain1, domain2, tuple(bands1.tolist()), tuple(bands2.tolist()),
+            checkpoint_digest(params), tuple(sorted(options.items())))
+
+def checkpoint_digest(params):
+    '''
+    SHA-1 of the model checkpoint, computed once per checkpoint version
+    Args:
+        params (dict): Model parameters with model_path
+    Returns:
+        str
+    '''
+    checkpoint_path = os.path.abspath(os.path.join(params['model_path'], 'checkpoint.flownet.pth.tar'))
+    return _file_digest(checkpoint_path, os.path.getmtime(checkpoint_path))
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path, mtime):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
 def load_model(config_file, device=None):
     '''
-    Load SplitGenVAE model for inference
+    Load SplitGenVAE model for inference, in evaluation mode
     Args:
         config_file: get parameters and model_directory from configuration file
         device: set device for inference
@@ -93,6 +296,27 @@ def load_model(config_file, device=None):
     checkpoint_path = os.path.join(params['model_path'], 'checkpoint.flownet.pth.tar')
     checkpoint = torch.load(checkpoint_path, map_location=device)
     model.load_state_dict(checkpoint['gen_state'])
+    model.eval()
     step = checkpoint['global_step']
     print(f"Loaded model from step: {step}")
-    return model, params
\ No newline at end of file
+    return model, params
+
+def get_model(config_file, device=None, dtype=torch.float32):
+    '''
+    Load SplitGenVAE model for inference once per process, later calls with the same
+    configuration, device and dtype return the same model. Conv blocks are fused for inference.
+    Args:
+        config_file: get parameters and model_directory from configuration file
+        device: set device for inference
+        dtype: floating point type of the model parameters
+    Return:
+        SplitGenVAE (torch.nn.Module)
+        params (dict)
+    '''
+    device = _get_device(device)
+    key = (os.path.abspath(config_file), str(device), dtype)
+    with _models_lock:
+        if key not in _models:
+            model, params = load_model(config_file, device=device)
+            _models[key] = (fuse_model(model).to(dtype), params)
+        return _models[key]
@@ -1,6 +1,5 @@
 import torch
 from torch import nn
-from torch.autograd import Variable
 from .unit_networks import ContentEncoder, Decoder, DecoderSkip, ResBlocks
 
 class SpectralEncoder(nn.Module):
@@ -66,17 +65,20 @@ class SplitGenVAE(nn.Module):
         self.decoders = nn.ModuleDict(decoders)
         self.shared = ResBlocks(1, enc_dim, norm='none', activation='relu')
 
-    def encode(self, x, name):
+    def encode(self, x, name, noise=True):
         enc = self.encoders[name](x)
         enc = self.shared(enc)
-        noise = Variable(torch.randn(enc.size()).cuda(enc.data.get_device()))
+        if not noise:
+            # inference does not sample the latent space
+            return enc, None
+        noise = torch.randn_like(enc)
         return enc, noise
 
-    def decode(self, z, name, skip_x=None):
+    def decode(self, z, name, skip_x=None, bands=None):
         if self.skip_dim:
-            return self.decoders[name](z, skip_x)
+            return self.decoders[name](z, skip_x, bands=bands)
         else:
-            return self.decoders[name](z)
+            return self.decoders[name](z, bands=bands)
 
     def forward(self, x, name, skip_x=None):
         z, _ = self.encode(x, name)
@@ -0,0 +1,163 @@
+'''
+Reduced precision CPU inference for a single domain pair. Conv layers are either statically
+quantized to int8 using calibration frames from real L1G tiles, or run under bfloat16 autocast.
+The validation tool reports per-band error against the float32 model on held out frames.
+
+    python -m model.quantize G17 H8 --bands2 1 --mode int8 --calibration <hdf files> --validation <hdf files> --output model/g17_h8_int8.pt
+'''
+import argparse
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from .export import DomainTranslator, save
+from .fusion import fuse_model
+from .inference import load_model
+
+class BFloat16Translator(nn.Module):
+    '''
+    Runs a DomainTranslator under bfloat16 autocast, normalization and outputs stay float32
+    '''
+    def __init__(self, translator):
+        super(BFloat16Translator, self).__init__()
+        self.translator = translator
+        self.mu1 = translator.mu1
+
+    def forward(self, x):
+        with torch.autocast('cpu', dtype=torch.bfloat16):
+            return self.translator(x)
+
+def quantize_int8(model, domain1, domain2, calibration, bands1=None, bands2=None, batch_size=4):
+    '''
+    Post-training static int8 quantization of the translation from domain1 to domain2
+    Args:
+        model (SplitGenVAE): pytorch module
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        calibration (np.array or iterable): Frames of shape (H,W,C) to calibrate activation ranges
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+        batch_size (int): Number of calibration frames per forward pass
+    Returns:
+        torch.nn.Module taking inputs of shape (N,H,W,C)
+    '''
+    translator = DomainTranslator(fuse_model(model), domain1, domain2, bands1=bands1, bands2=bands2)
+    translator = translator.cpu().float().eval()
+
+    # quantized leaky_relu has no in-place kernel and would warn on every forward. The modules
+    # belong to model, e.g. the one shared by get_model, their flag is restored once converted.
+    inplace = [m for m in translator.modules() if isinstance(m, nn.LeakyReLU) and m.inplace]
+    for module in inplace:
+        module.inplace = False
+
+    try:
+        calibration = _as_inputs(calibration, bands1)
+        prepared = prepare_fx(translator, get_default_qconfig_mapping('x86'), (calibration[:1],))
+        with torch.no_grad():
+            for i in range(0, len(calibration), batch_size):
+                prepared(calibration[i:i+batch_size])
+        return convert_fx(prepared)
+    finally:
+        for module in inplace:
+            module.inplace = True
+
+def quantize_bfloat16(model, domain1, domain2, bands1=None, bands2=None):
+    '''
+    Translation from domain1 to domain2 under bfloat16 autocast
+    Args:
+        model (SplitGenVAE): pytorch module
+        domain1 (str): Name of data domain (G16,G17,H8)
+        domain2 (str): Name of target domain (G16,G17,H8)
+        bands1 (list or np.array): Indices of bands to select as inputs
+        bands2 (list or np.array): Indices of bands to select as outputs
+    Returns:
+        torch.nn.Module taking inputs of shape (N,H,W,C)
+    '''
+    translator = DomainTranslator(fuse_model(model), domain1, domain2, bands1=bands1, bands2=bands2)
+    return BFloat16Translator(translator.cpu().float().eval())
+
+def band_errors(reference, candidate, frames, bands1=None, batch_size=4):
+    '''
+    Per-band error of a reduced precision translation against the float32 reference
+    Args:
+        reference (torch.nn.Module): float32 translation, e.g. DomainTranslator
+        candidate (torch.nn.Module): reduced precision translation
+        frames (np.array or iterable): Frames of shape (H,W,C)
+        bands1 (list or np.array): Indices of bands to select as inputs
+        batch_size (int): Number of frames per forward pass
+    Returns:
+        dict of np.array with the mean absolute, root mean square and maximum absolute error
+        of each output band
+    '''
+    frames = _as_inputs(frames, bands1)
+    abs_sum, sq_sum, abs_max, count = 0., 0., 0., 0
+    with torch.inference_mode():
+        for i in range(0, len(frames), batch_size):
+            x = frames[i:i+batch_size]
+            diff = (candidate(x) - reference(x)).numpy()
+            diff = diff.reshape(-1, diff.shape[-1])
+            valid = ~np.isnan(diff)
+            diff = np.where(valid, diff, 0.)
+            abs_sum = abs_sum + np.abs(diff).sum(0)
+            sq_sum = sq_sum + (diff**2).sum(0)
+            abs_max = np.maximum(abs_max, np.abs(diff).max(0))
+            count = count + valid.sum(0)
+    return dict(mae=abs_sum / count, rmse=np.sqrt(sq_sum / count), max=abs_max)
+
+def _as_inputs(frames, bands1):
+    frames = np.stack(list(frames))
+    if bands1 is not None:
+        frames = frames[..., bands1]
+    return torch.as_tensor(frames, dtype=torch.float32)
+
+def _parse_bands(bands):
+    if bands is None:
+        return None
+    return [int(b) for b in bands.split(',')]
+
+if __name__ == '__main__':
+    from utils import geonexl1g
+
+    parser = argparse.ArgumentParser(description='Reduced precision SplitGenVAE domain translation')
+    parser.add_argument('domain1', help='data domain (G16,G17,H8)')
+    parser.add_argument('domain2', help='target domain (G16,G17,H8)')
+    parser.add_argument('--config', default='model/params.yaml', help='model configuration file')
+    parser.add_argument('--bands1', help='comma separated input band indices')
+    parser.add_argument('--bands2', help='comma separated output band indices')
+    parser.add_argument('--mode', choices=['int8', 'bf16'], default='int8', help='reduced precision mode')
+    parser.add_argument('--calibration', nargs='+', required=True, help='L1G files to calibrate on')
+    parser.add_argument('--validation', nargs='+',
+                        help='L1G files to report errors on, default holds out the last quarter of the calibration files')
+    parser.add_argument('--resolution', type=float, default=1., help='resolution in km of the frames')
+    parser.add_argument('--output', help='path of the saved TorchScript artifact')
+    args = parser.parse_args()
+
+    bands1, bands2 = _parse_bands(args.bands1), _parse_bands(args.bands2)
+    calibration, validation = args.calibration, args.validation
+    if validation is None:
+        if len(calibration) < 2:
+            parser.error('--validation is required with a single calibration file')
+        held_out = max(len(calibration) // 4, 1)
+        calibration, validation = calibration[:-held_out], calibration[-held_out:]
+    frames = [geonexl1g.L1GFile(f, resolution_km=args.resolution).load() for f in calibration]
+    validation = [geonexl1g.L1GFile(f, resolution_km=args.resolution).load() for f in validation]
+
+    model, _ = load_model(args.config, device='cpu')
+    reference = DomainTranslator(fuse_model(model), args.domain1, args.domain2, bands1=bands1, bands2=bands2)
+    reference = reference.cpu().float().eval()
+    if args.mode == 'int8':
+        candidate = quantize_int8(model, args.domain1, args.domain2, frames, bands1=bands1, bands2=bands2)
+    else:
+        candidate = quantize_bfloat16(model, args.domain1, args.domain2, bands1=bands1, bands2=bands2)
+
+    errors = band_errors(reference, candidate, validation, bands1=bands1)
+    print('band        mae       rmse        max')
+    out_bands = bands2 if bands2 is not None else range(len(errors['mae']))
+    for i, b in enumerate(out_bands):
+        print('%4i %10.4f %10.4f %10.4f' % (b, errors['mae'][i], errors['rmse'][i], errors['max'][i]))
+
+    if args.output:
+        save(candidate, args.output, size=frames[0].shape[0])
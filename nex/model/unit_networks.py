@@ -236,9 +236,13 @@ class Decoder(nn.Module):
         # use reflection padding in the last conv layer
         self.model += [Conv2dBlock(dim, output_dim, 3, 1, 1, norm='none', activation='none', pad_type=pad_type)]
         self.model = nn.Sequential(*self.model)
+        self.output_dim = output_dim
 
-    def forward(self, x):
-        return self.model(x)
+    def forward(self, x, bands=None):
+        if bands is None:
+            return self.model(x)
+        # only compute the requested output channels in the last conv layer
+        return self.model[-1].forward_channels(self.model[:-1](x), bands)
 
 class DecoderSkip(nn.Module):
     def __init__(self, n_upsample, n_res, dim, output_dim, skip_dim=1, res_norm='adain', activ='relu', pad_type='zero'):
@@ -258,10 +262,14 @@ class DecoderSkip(nn.Module):
         #self.inner_model += [Conv2dBlock(dim, output_dim, 3, 1, 1, norm='none', activation='none', pad_type=pad_type)]
         self.inner_model = nn.Sequential(*self.inner_model)
         self.conv_out = Conv2dBlock(dim+len(self.skip_dim), output_dim, 3, 1, 1, norm='none', activation='none', pad_type=pad_type)
+        self.output_dim = output_dim
 
-    def forward(self, x, skip_x):
+    def forward(self, x, skip_x, bands=None):
         x_inner = self.inner_model(x)
-        return self.conv_out(torch.cat([x_inner, skip_x], 1))
+        if bands is None:
+            return self.conv_out(torch.cat([x_inner, skip_x], 1))
+        # only compute the requested output channels in the last conv layer
+        return self.conv_out.forward_channels(torch.cat([x_inner, skip_x], 1), bands)
 
 
 ##################################################################################
@@ -368,6 +376,18 @@ class Conv2dBlock(nn.Module):
             x = self.activation(x)
         return x
 
+    def forward_channels(self, x, channels):
+        # convolve with a subset of the output filters, normalization would mix channels
+        assert self.norm is None, "Unsupported normalization for channel selection: {}".format(self.norm)
+        channels = torch.as_tensor(channels, dtype=torch.long, device=self.conv.weight.device)
+        weight = self.conv.weight.index_select(0, channels)
+        bias = self.conv.bias.index_select(0, channels) if self.conv.bias is not None else None
+        x = F.conv2d(self.pad(x), weight, bias, self.conv.stride, self.conv.padding,
+                     self.conv.dilation, self.conv.groups)
+        if self.activation:
+            x = self.activation(x)
+        return x
+
 class LinearBlock(nn.Module):
     def __init__(self, input_dim, output_dim, norm='none', activation='relu'):
         super(LinearBlock, self).__init__()
@@ -29,13 +29,113 @@ def get_sensor_stats(sensor):
         sd = (0.03, 0.1, 0.2, 0.3, 0.3, 0.3)
     return mu, sd
 
-def make_patches(x, patch_size):
+def receptive_radius(params):
+    '''
+    Distance in input pixels beyond which an input has no effect on an output of the generator,
+    exact without downsampling and an upper bound otherwise
+    Args:
+        params (dict): Model parameters, see get_config
+    Returns:
+        int
+    '''
+    n_res = params['gen']['n_res']
+    jump = 2 ** params['gen']['n_downsample']
+    # 7x7 input conv of the encoder and its 4x4 stride 2 downsampling convs
+    radius = 3 + 2 * (jump - 1)
+    # two 3x3 convs in each residual block of the encoder, the shared block and the decoder
+    radius += 2 * (2 * n_res + 1) * jump
+    # 3x3 conv after each nearest neighbour upsampling, including its rounding
+    radius += 2 * (jump - 1)
+    # 3x3 output conv of the decoder
+    return radius + 1
+
+def check_patches(patch_size, overlap=0, margin=0):
+    '''
+    Raise a ValueError unless patches of patch_size sharing overlap pixels can be cropped by margin
+    '''
+    if patch_size < 1:
+        raise ValueError(f'patch_size must be positive, got {patch_size}')
+    if not 0 <= overlap < patch_size:
+        raise ValueError(f'overlap must be in [0, patch_size={patch_size}), got {overlap}')
+    if margin < 0 or 2 * margin > overlap:
+        raise ValueError(f'margin must be in [0, overlap/2={overlap/2:g}] so cropped patches still '
+                         f'cover the image, got {margin}')
+
+def patch_origins(size, patch_size, overlap=0):
+    '''
+    Start indices of patches covering an axis of length size, the last patch is aligned to the end
+    '''
+    check_patches(patch_size, overlap)
+    r = list(range(0, max(size - overlap, 1), patch_size - overlap))
+    r[-1] = size - patch_size
+    return r
+
+def iter_patches(x, patch_size, overlap=0):
+    '''
+    Square patches of an (H,W,C) array in row-major order, yielded as views without copying
+    '''
     h, w, c = x.shape
-    r = list(range(0, h, patch_size))
-    r[-1] = h - patch_size
-    samples = [x[np.newaxis,i:i+patch_size, j:j+patch_size] for i in r for j in r]
-    samples = np.concatenate(samples, 0)
-    return samples
+    for i in patch_origins(h, patch_size, overlap):
+        for j in patch_origins(w, patch_size, overlap):
+            yield x[i:i+patch_size, j:j+patch_size]
+
+def make_patches(x, patch_size, overlap=0):
+    return np.stack(list(iter_patches(x, patch_size, overlap)), 0)
+
+def _ramp(patch_size, overlap, margin=0, first=False, last=False):
+    # 1D blending weights, zero over the cropped margin and rising linearly over the rest of the
+    # overlap, sides at the border of the image are neither cropped nor ramped
+    ramp = np.ones(patch_size, dtype=np.float32)
+    n = overlap - 2 * margin
+    edge = np.concatenate([np.zeros(margin, np.float32),
+                           np.arange(1, n + 1, dtype=np.float32) / (n + 1)])
+    if len(edge) == 0:
+        return ramp
+    if not first:
+        ramp[:len(edge)] = edge
+    if not last:
+        ramp[-len(edge):] = np.minimum(ramp[-len(edge):], edge[::-1])
+    return ramp
+
+def feather_weights(patch_size, overlap, margin=0):
+    '''
+    2D blending weights which are zero over margin and ramp up linearly over the rest of the
+    overlapping border of a patch
+    '''
+    ramp = _ramp(patch_size, overlap, margin)
+    return np.outer(ramp, ramp)
+
+def stitch_patches(patches, shape, patch_size, overlap=0, margin=0):
+    '''
+    Blend patches in iter_patches order back into a single image. Pixels within margin of a
+    patch border which is inside the image are discarded, so zero-padding artifacts of a model
+    whose receptive field reaches up to margin pixels do not show up as seams.
+    Args:
+        patches (iterable): Arrays of shape (patch_size,patch_size,C)
+        shape (tuple): (H,W) of the output image
+        patch_size (int): Size of each square patch
+        overlap (int): Number of pixels shared by neighbouring patches
+        margin (int): Number of border pixels of each patch to discard, at most overlap/2
+    Returns:
+        np.array of shape (H,W,C)
+    '''
+    check_patches(patch_size, overlap, margin)
+    h, w = shape
+    rows = patch_origins(h, patch_size, overlap)
+    cols = patch_origins(w, patch_size, overlap)
+    row_ramps = [_ramp(patch_size, overlap, margin, i == 0, i == h - patch_size) for i in rows]
+    col_ramps = [_ramp(patch_size, overlap, margin, j == 0, j == w - patch_size) for j in cols]
+    origins = [(i, j, np.outer(ri, rj)[:,:,np.newaxis]) for i, ri in zip(rows, row_ramps)
+                                                         for j, rj in zip(cols, col_ramps)]
+    out = None
+    norm = np.zeros((h, w, 1), dtype=np.float32)
+    for (i, j, weights), patch in zip(origins, patches):
+        if out is None:
+            out = np.zeros((h, w, patch.shape[-1]), dtype=patch.dtype)
+        # discarded pixels are masked rather than weighted so a nan there cannot propagate
+        out[i:i+patch_size, j:j+patch_size] += np.where(weights > 0, patch * weights, 0)
+        norm[i:i+patch_size, j:j+patch_size] += weights
+    return out / norm
 
 def weights_init(init_type='gaussian'):
     def init_fun(m):
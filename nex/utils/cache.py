@@ -0,0 +1,119 @@
+import os
+import hashlib
+import tempfile
+import time
+
+import numpy as np
+
+class ArrayCache(object):
+    '''
+    On-disk cache of arrays stored as .npy files and served memory-mapped, so a hit costs no
+    decoding and no copy. Files are evicted least recently used first once the directory grows
+    beyond max_bytes, or once they have not been used for max_age seconds. The size of the
+    directory is tracked by a running total, which is only checked against the directory by
+    an eviction pass once it exceeds max_bytes.
+    Args:
+        directory: Directory of the cache, created if needed
+        max_bytes (optional): Size cap of the cache in bytes, default unbounded
+        max_age (optional): Seconds after which unused entries are evicted, default unbounded
+    '''
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # bytes in the directory as of the last eviction plus those written since, None until scanned
+        self._size = None
+        self._evicted = 0.
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest + '.npy')
+
+    def get(self, key):
+        '''
+        Args:
+            key: Hashable description of the entry, its repr must be stable across processes
+        Returns:
+            read-only memory-mapped np.array, or None if the entry is not cached
+        '''
+        path = self.path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+            # the modification time tracks the last use
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return array
+
+    def put(self, key, array):
+        '''
+        Store an array and evict old entries
+        Args:
+            key: Hashable description of the entry, its repr must be stable across processes
+            array: np.array to store
+        Returns:
+            read-only memory-mapped np.array of the stored entry, or array itself if the entry
+            was already evicted by another process
+        '''
+        path = self.path(key)
+        # write to a temporary file first so concurrent readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
+        if self._size is not None:
+            self._size += os.path.getsize(path)
+        if self._needs_eviction():
+            self.evict(keep=path)
+        try:
+            return np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return array
+
+    def _needs_eviction(self):
+        if self.max_bytes is None and self.max_age is None:
+            return False
+        if self._size is None:
+            return True
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            return True
+        # expired entries are looked for at most every max_age or hour, whichever is shorter
+        return self.max_age is not None and time.time() - self._evicted > min(self.max_age, 3600.)
+
+    def evict(self, keep=None):
+        '''
+        Remove expired entries, then least recently used entries until under max_bytes
+        Args:
+            keep (optional): Path of an entry which is never removed, e.g. the one just stored
+        '''
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.npy'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if path == keep:
+                continue
+            expired = self.max_age is not None and now - mtime > self.max_age
+            oversize = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or oversize):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+        self._evicted = now
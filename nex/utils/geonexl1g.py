@@ -1,57 +1,510 @@
 import os, sys
+import sqlite3
+import time
+from contextlib import closing
 import numpy as np
 from pyhdf.SD import SD, SDC
 from scipy import ndimage
 import glob
 import pandas as pd
 
+# year, day of year, time and tile of an L1G file path
+_FILE_PATTERN = (r'(?P<year>\d{4})/(?P<dayofyear>\d{3})/[^/]*_\d{8}_(?P<hour>\d{2})(?P<minute>\d{2})_'
+                 r'[^/_]*_(?P<tile>h(?P<h>\d{2})v(?P<v>\d{2}))_[^/]*\.hdf$')
+_FILE_COLUMNS = ['year', 'dayofyear', 'hour', 'minute', 'file', 'tile', 'h', 'v']
+
+def _tiles(tile):
+    # list of tiles from a tile or a list of tiles
+    return [tile] if isinstance(tile, str) else list(tile)
+
+def _subdirs(path):
+    # names and paths of the subdirectories of path, empty if it does not exist
+    try:
+        with os.scandir(path) as entries:
+            return [(e.name, e.path) for e in entries if e.is_dir()]
+    except FileNotFoundError:
+        return []
+
+def parse_files(files):
+    '''
+    Vectorized parsing of L1G file paths of the form .../<year>/<doy>/<name>_<yyyymmdd>_<hhmm>_<grid>_<tile>_<version>.hdf
+    Args:
+        files: List of filepaths
+    Returns:
+        pd.DataFrame with year, dayofyear, hour, minute, file, tile, h, and v, paths which
+        do not match are dropped
+    '''
+    files = pd.Series(files, dtype=str)
+    info = files.str.extract(_FILE_PATTERN).dropna()
+    info['file'] = files[info.index]
+    for c in ['year', 'dayofyear', 'hour', 'minute', 'h', 'v']:
+        info[c] = info[c].astype(int)
+    return info[_FILE_COLUMNS].reset_index(drop=True)
+
+def _read_band(fp, b):
+    # raw band values with their scale factor and offset
+    b_obj = fp.select('BAND%02i' % b)
+    attrs = b_obj.attributes()
+    return b_obj.get(), attrs['Scale_Factor'], attrs['Offset_Constant']
+
+def _decode_band(arr, scale_factor, offset, resolution_size):
+    # scale a raw band to physical units and resample it to the common grid
+    #fill_value = attrs['_FillValue'] ## this fill value seems to be wrong in l1g
+    fill_value = 32768.
+    arr = arr.astype(np.float32)
+    arr[arr == fill_value] = np.nan
+    arr *= scale_factor
+    arr += offset
+    if arr.shape[0] != resolution_size:
+        arr = ndimage.interpolation.zoom(arr, resolution_size/arr.shape[0], order=1)
+    return arr
+
+def load_file(file, bands=list((range(1,17))), resolution_km=2., dtype=np.float32, cache=None, out=None):
+    '''
+    Read a single L1B file at a common resolution, picklable for process pools
+    Args:
+        file: Filepath to L1b
+        bands (optional): List of bands, default=list(range(1,17))
+        resolution_km (optional): Resolution in km for common grid, default=2
+        dtype (optional): Data type of the returned array, default=np.float32
+        cache (optional): cache.ArrayCache of decoded arrays
+        out (optional): Preallocated array of shape (size, size, len(bands)) to fill, only
+            useful when loading in the same process
+    Returns:
+        np.array of shape (size, size, len(bands)), out if given
+    '''
+    return L1GFile(file, bands=bands, resolution_km=resolution_km, dtype=dtype).load(out=out, cache=cache)
+
+def load_files(files, bands=list((range(1,17))), resolution_km=2., dtype=np.float32, out=None,
+               executor=None, cache=None):
+    '''
+    Read several L1B files at a common resolution
+    Args:
+        files: List of filepaths to L1b
+        bands (optional): List of bands, default=list(range(1,17))
+        resolution_km (optional): Resolution in km for common grid, default=2
+        dtype (optional): Data type of the returned arrays, default=np.float32
+        out (optional): Preallocated array of shape (>=len(files), size, size, len(bands)) to fill
+        executor (optional): concurrent.futures Executor to load files concurrently,
+            a ProcessPoolExecutor avoids the HDF4 library lock
+        cache (optional): cache.ArrayCache of decoded arrays
+    Returns:
+        list of np.array in the order of files, or out[:len(files)] if given
+    '''
+    if executor is None:
+        if out is None:
+            return [load_file(f, bands, resolution_km, dtype, cache) for f in files]
+        for f, o in zip(files, out):
+            L1GFile(f, bands=bands, resolution_km=resolution_km, dtype=dtype).load(out=o, cache=cache)
+        return out[:len(files)]
+    n = len(files)
+    arrays = executor.map(load_file, files, [bands] * n, [resolution_km] * n, [dtype] * n, [cache] * n)
+    if out is None:
+        return list(arrays)
+    for o, arr in zip(out, arrays):
+        o[...] = arr
+    return out[:n]
+
 class L1GFile(object):
     '''
     Reads a single L1B file at a common resolution. Channels are bilinearly interpolated to the defined resolution.
+        Single bands can be read lazily with band(), which decodes a band on first access and caches it.
     Args:
         file: Filepath to L1b
         bands (optional): List of bands, default=list(range(1,17))
         resolution_km (optional): Resolution in km for common grid, default=2
+        dtype (optional): Data type of the loaded array, default=np.float32
     '''
     def __init__(self, file, bands=list((range(1,17))),
-                 resolution_km=2.):
+                 resolution_km=2., dtype=np.float32):
         self.file = file
         self.bands = bands
         self.resolution_km = resolution_km
+        self.dtype = dtype
         self.resolution_size = int(600. / resolution_km)
         self.reflective_bands = list(range(1,7))
         self.emissive_bands = list(range(7,17))
+        self._band_cache = dict()
+
+    def cache_key(self):
+        '''Identity of the decoded array, changes when the file is rewritten'''
+        return (os.path.abspath(self.file), os.path.getmtime(self.file), tuple(self.bands),
+                float(self.resolution_km), np.dtype(self.dtype).str)
+
+    def load(self, out=None, executor=None, cache=None):
+        '''
+        Args:
+            out (optional): Preallocated array of shape (resolution_size, resolution_size, len(bands))
+                to fill, allows recycling frame buffers
+            executor (optional): concurrent.futures Executor to decode and resample bands concurrently
+            cache (optional): cache.ArrayCache of decoded arrays, hits skip reading the HDF file and
+                are returned memory-mapped and read-only unless out is given
+        Returns:
+            np.array of shape (resolution_size, resolution_size, len(bands))
+        '''
+        shape = (self.resolution_size, self.resolution_size, len(self.bands))
+        if out is not None and out.shape != shape:
+            raise ValueError(f'Output buffer has shape {out.shape}, expected {shape}')
+
+        if cache is not None:
+            key = self.cache_key()
+            cached = cache.get(key)
+            if cached is None:
+                data_array = self.load(out=out, executor=executor)
+                cache.put(key, data_array)
+                return data_array
+            if out is None:
+                return cached
+            out[...] = cached
+            return out
 
-    def load(self):
+        # bands decoded earlier through band() are not read again
+        missing = [b for b in self.bands if b not in self._band_cache]
         fp = SD(self.file, SDC.READ)
-        data_array = np.zeros((self.resolution_size, self.resolution_size, len(self.bands)))
+        # the HDF4 library is not thread safe, read raw bands serially
+        raw = [_read_band(fp, b) for b in missing]
+        fp.end()
+
+        if executor is None:
+            decoded = (_decode_band(arr, s, o, self.resolution_size) for arr, s, o in raw)
+        else:
+            decoded = executor.map(_decode_band, *zip(*raw), [self.resolution_size] * len(raw))
+        decoded = dict(zip(missing, decoded))
+
+        data_array = out if out is not None else np.empty(shape, dtype=self.dtype)
         for i, b in enumerate(self.bands):
-            b_obj = fp.select('BAND%02i' % b)
-            attrs = b_obj.attributes()
-            scale_factor = attrs['Scale_Factor']
-            #fill_value = attrs['_FillValue'] ## this fill value seems to be wrong in l1g
-            fill_value = 32768.
-            arr = b_obj.get()[:].astype(np.float32)
-            offset = attrs['Offset_Constant']
-            arr[arr == fill_value] = np.nan
-            arr *= scale_factor
-            arr += offset
-            if arr.shape[0] != self.resolution_size:
-                arr = ndimage.interpolation.zoom(arr, self.resolution_size/arr.shape[0], order=1)
-            data_array[:,:,i] = arr
+            data_array[:,:,i] = self._band_cache[b] if b in self._band_cache else decoded[b]
         #self.data_array = data_array
         return data_array
 
+    def band(self, b):
+        '''
+        Decode and resample a single band on first access, later accesses are served from memory
+        Args:
+            b: Band number
+        Returns:
+            np.array of shape (resolution_size, resolution_size)
+        '''
+        if b not in self._band_cache:
+            fp = SD(self.file, SDC.READ)
+            arr, scale_factor, offset = _read_band(fp, b)
+            fp.end()
+            arr = _decode_band(arr, scale_factor, offset, self.resolution_size)
+            self._band_cache[b] = arr.astype(self.dtype, copy=False)
+        return self._band_cache[b]
+
     def solar(self):
         fp = SD(self.file, SDC.READ)
         sa = fp.select('Solar_Azimuth').get()[:]
         sz = fp.select('Solar_Zenith').get()[:]
         return sa*0.01, sz*0.01
 
+# directories modified this recently are listed again on the next refresh, files
+# added within the resolution of their modification time would be missed otherwise
+_SETTLE_SECONDS = 2.
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (collection TEXT, sensor TEXT, year INTEGER, dayofyear INTEGER,
+    hour INTEGER, minute INTEGER, file TEXT PRIMARY KEY, tile TEXT, h INTEGER, v INTEGER, dir TEXT);
+CREATE INDEX IF NOT EXISTS files_time ON files (collection, tile, year, dayofyear, hour);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+'''
+
+class FileIndex(object):
+    '''
+    Persistent SQLite index of the files of L1G collections. Every directory is stored with
+    the modification time of its last listing, a refresh only lists directories whose
+    modification time changed, so new overpasses are picked up at the cost of one stat per
+    directory. Queries do not touch the collection.
+    Args:
+        path: Path of the index database, its directory is created if needed
+    '''
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        # readers do not block the refresh of another process
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def refresh(self, collection, sensor, tile=None, year=None, days=None):
+        '''
+        Bring the index of a collection up to date, restricted to the requested tiles and times
+        Args:
+            collection: L1G data directory
+            sensor: Sensor of the collection (G16,G17,H8)
+            tile (optional): Tile or list of tiles from GeoNEX grid, all tiles if None
+            year (optional): Year, all years if None
+            days (optional): Range [first, stop) of days of year, stop excluded as in range()
+        Returns:
+            Number of directories which were listed
+        '''
+        root = os.path.abspath(collection)
+        now = time.time()
+        listed = 0
+        # the walk only reads the index, changes are written at the end in a single short
+        # transaction so other processes are not locked out while directories are listed
+        removed, new_dirs, mtimes, day_files = [], [], [], {}
+
+        with closing(self._connect()) as conn:
+            def children(path):
+                # subdirectories of path, listed again only if it changed since the last refresh
+                nonlocal listed
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    removed.append(path)
+                    return []
+                if self._mtime(conn, path) == mtime:
+                    rows = conn.execute('SELECT path FROM dirs WHERE parent=?', (path,))
+                    return [(os.path.basename(p), p) for p, in rows]
+
+                listed += 1
+                subdirs = _subdirs(path)
+                current = set(p for _, p in subdirs)
+                for p, in conn.execute('SELECT path FROM dirs WHERE parent=?', (path,)).fetchall():
+                    if p not in current:
+                        removed.append(p)
+                new_dirs.extend((p, path) for p in current)
+                mtimes.append((path, mtime))
+                return subdirs
+
+            def scan_day(path):
+                nonlocal listed
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    removed.append(path)
+                    return
+                if self._mtime(conn, path) == mtime:
+                    return
+
+                listed += 1
+                with os.scandir(path) as entries:
+                    files = parse_files([e.path for e in entries if e.name.endswith('.hdf')])
+                day_files[path] = [(root, sensor, int(r.year), int(r.dayofyear), int(r.hour), int(r.minute),
+                                    r.file, r.tile, int(r.h), int(r.v), path)
+                                   for r in files.itertuples(index=False)]
+                mtimes.append((path, mtime))
+
+            if tile is None:
+                tile_dirs = [(t, p) for t, p in children(root) if t[0] == 'h']
+            else:
+                tile_dirs = [(t, os.path.join(root, t)) for t in _tiles(tile)]
+            for _, tile_dir in tile_dirs:
+                for y, year_dir in children(tile_dir):
+                    if not y.isdigit() or (year is not None and int(y) != int(year)):
+                        continue
+                    for d, day_dir in children(year_dir):
+                        if not d.isdigit() or (days is not None and not days[0] <= int(d) < days[1]):
+                            continue
+                        scan_day(day_dir)
+
+            with conn:
+                conn.execute('UPDATE files SET sensor=? WHERE collection=? AND sensor!=?', (sensor, root, sensor))
+                for path in removed:
+                    self._remove(conn, path)
+                conn.executemany('INSERT OR IGNORE INTO dirs (path, parent) VALUES (?, ?)', new_dirs)
+                for path, rows in day_files.items():
+                    conn.execute('DELETE FROM files WHERE dir=?', (path,))
+                    conn.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?)', rows)
+                for path, mtime in mtimes:
+                    self._set_mtime(conn, path, os.path.dirname(path), mtime, now)
+        return listed
+
+    def query(self, collection, sensor=None, tile=None, year=None, days=None, hours=None):
+        '''
+        Files of a collection from the index, without listing any directory
+        Args:
+            collection: L1G data directory
+            sensor (optional): Sensor of the collection (G16,G17,H8)
+            tile (optional): Tile or list of tiles from GeoNEX grid, all tiles if None
+            year (optional): Year, all years if None
+            days (optional): Range [first, stop) of days of year, stop excluded as in range()
+            hours (optional): Range [first, last] of hours, last included
+        Returns:
+            pd.DataFrame of filelist with year, dayofyear, hour, minute, file, tile, h, and v
+            sorted by year, dayofyear, hour, minute and tile
+        '''
+        where, params = ['collection=?'], [os.path.abspath(collection)]
+        if sensor is not None:
+            where.append('sensor=?'); params.append(sensor)
+        if tile is not None:
+            tiles = _tiles(tile)
+            where.append('tile IN (%s)' % ','.join('?' * len(tiles))); params += tiles
+        if year is not None:
+            where.append('year=?'); params.append(int(year))
+        if days is not None:
+            where.append('dayofyear>=? AND dayofyear<?'); params += [int(days[0]), int(days[1])]
+        if hours is not None:
+            where.append('hour>=? AND hour<=?'); params += [int(hours[0]), int(hours[1])]
+
+        sql = ('SELECT year, dayofyear, hour, minute, file, tile, h, v FROM files WHERE '
+               + ' AND '.join(where) + ' ORDER BY year, dayofyear, hour, minute, tile')
+        with closing(self._connect()) as conn:
+            files = pd.read_sql_query(sql, conn, params=params)
+        # columns of an empty result are untyped, as those of parse_files the numbers are integers
+        return files.astype({c: np.int64 for c in ['year', 'dayofyear', 'hour', 'minute', 'h', 'v']})
+
+    def _mtime(self, conn, path):
+        row = conn.execute('SELECT mtime FROM dirs WHERE path=?', (path,)).fetchone()
+        return None if row is None else row[0]
+
+    def _set_mtime(self, conn, path, parent, mtime, now):
+        if now - mtime / 1e9 < _SETTLE_SECONDS:
+            mtime = None
+        conn.execute('INSERT INTO dirs (path, parent, mtime) VALUES (?, ?, ?) '
+                     'ON CONFLICT(path) DO UPDATE SET mtime=excluded.mtime', (path, parent, mtime))
+
+    def _remove(self, conn, path):
+        # a directory which disappeared and everything below it
+        prefix = path + os.sep
+        n = len(prefix)
+        conn.execute('DELETE FROM files WHERE dir=? OR substr(dir, 1, ?)=?', (path, n, prefix))
+        conn.execute('DELETE FROM dirs WHERE path=? OR substr(path, 1, ?)=?', (path, n, prefix))
+
+# longitude of the sub-satellite point of the geostationary sensors
+SUBSATELLITE_LONGITUDE = {'G16': -75.2, 'G17': -137.2, 'H8': 140.7}
+
+def tile_coordinates(tile, size):
+    '''
+    Latitude and longitude of the pixel centres of a tile of the 6 degree GeoNEX grid, h00 starts
+    at 180W and v00 at 60N
+    Args:
+        tile: Tile from GeoNEX grid, e.g. h09v03
+        size: Number of pixels along each side
+    Returns:
+        np.arrays of latitude and longitude in degrees of shape (size, size)
+    '''
+    h, v = int(tile[1:3]), int(tile[4:6])
+    centres = (np.arange(size) + 0.5) * 6. / size
+    return np.meshgrid(60. - v * 6. - centres, -180. + h * 6. + centres, indexing='ij')
+
+def view_zenith(tile, sensor, size):
+    '''
+    Viewing zenith angle of a geostationary sensor over a tile
+    Args:
+        tile: Tile from GeoNEX grid, e.g. h09v03
+        sensor: (G16,G17,H8)
+        size: Number of pixels along each side
+    Returns:
+        np.array of angles in degrees of shape (size, size), above 90 where the tile is not visible
+    '''
+    lat, lon = tile_coordinates(tile, size)
+    # cosine of the angle at the centre of the earth between pixel and sub-satellite point
+    cos_gamma = np.cos(np.radians(lat)) * np.cos(np.radians(lon - SUBSATELLITE_LONGITUDE[sensor]))
+    r, rs = 6378.137, 42164.16
+    distance = np.sqrt(r**2 + rs**2 - 2 * r * rs * cos_gamma)
+    return np.degrees(np.arccos(np.clip((rs * cos_gamma - r) / distance, -1., 1.)))
+
+def view_weights(tile, sensors, size):
+    '''
+    Compositing weights of several sensors over a tile, proportional to the cosine of their
+    viewing zenith angle so the sensor with the more direct view dominates
+    Args:
+        tile: Tile from GeoNEX grid, e.g. h09v03
+        sensors: List of sensors (G16,G17,H8)
+        size: Number of pixels along each side
+    Returns:
+        list of np.array of shape (size, size, 1) which sum to one
+    '''
+    weights = [np.clip(np.cos(np.radians(view_zenith(tile, s, size))), 0., None) for s in sensors]
+    total = sum(weights)
+    visible = total > 0
+    total[~visible] = 1.
+    # equal weights where no sensor sees the tile
+    return [np.where(visible, w / total, 1. / len(sensors))[..., None].astype(np.float32) for w in weights]
+
+def bbox_tiles(bbox):
+    '''
+    Tiles of the 6 degree GeoNEX grid which intersect a bounding box
+    Args:
+        bbox: [west, south, east, north] in degrees
+    Returns:
+        list of tiles, e.g. ['h09v02', 'h09v03']
+    '''
+    west, south, east, north = bbox
+    h = range(int(np.floor((west + 180.) / 6.)), int(np.ceil((east + 180.) / 6.)))
+    v = range(int(np.floor((60. - north) / 6.)), int(np.ceil((60. - south) / 6.)))
+    return ['h%02iv%02i' % (i, j) for j in v for i in h]
+
+def mosaic_files(files, tiles):
+    '''
+    Group a filelist of several tiles by scan time
+    Args:
+        files: pd.DataFrame of filelist, e.g. from GeoNEXL1G.catalog
+        tiles: List of tiles of the mosaic
+    Returns:
+        list of tuples with the file of each tile, None for tiles without a scan at that time,
+        sorted by year, dayofyear, hour and minute
+    '''
+    grid = files.pivot_table(index=['year', 'dayofyear', 'hour', 'minute'], columns='tile',
+                             values='file', aggfunc='first')
+    grid = grid.reindex(columns=tiles).sort_index().astype(object)
+    return [tuple(None if pd.isna(f) else f for f in row) for row in grid.itertuples(index=False)]
+
+def mosaic(arrays, tiles):
+    '''
+    Assemble arrays of tiles of the GeoNEX grid into one array
+    Args:
+        arrays: List of np.array of shape (H,W,C), None for missing tiles
+        tiles: List of tiles in the order of arrays
+    Returns:
+        np.array covering the bounding rectangle of tiles, nan where tiles are missing
+    '''
+    h = np.array([int(t[1:3]) for t in tiles])
+    v = np.array([int(t[4:6]) for t in tiles])
+    shape = next(a.shape for a in arrays if a is not None)
+    size_v, size_h = shape[:2]
+
+    out = np.full(((v.max() - v.min() + 1) * size_v, (h.max() - h.min() + 1) * size_h) + shape[2:],
+                  np.nan, dtype=np.float32)
+    for a, i, j in zip(arrays, h - h.min(), v - v.min()):
+        if a is not None:
+            out[j*size_v:(j+1)*size_v, i*size_h:(i+1)*size_h] = a
+    return out
+
+def load_tiles(files, bands=list((range(1,17))), resolution_km=2., dtype=np.float32, cache=None):
+    '''
+    Read the files of the tiles of a mosaic, picklable for process pools
+    Args:
+        files: List of filepaths to L1b, None for missing tiles
+        bands (optional): List of bands, default=list(range(1,17))
+        resolution_km (optional): Resolution in km for common grid, default=2
+        dtype (optional): Data type of the returned arrays, default=np.float32
+        cache (optional): cache.ArrayCache of decoded arrays
+    Returns:
+        list of np.array in the order of files, None for missing tiles
+    '''
+    return [None if f is None else load_file(f, bands, resolution_km, dtype, cache) for f in files]
+
+def load_mosaic(files, tiles, bands=list((range(1,17))), resolution_km=2., dtype=np.float32, cache=None):
+    '''
+    Read the files of the tiles of a mosaic and assemble them, picklable for process pools
+    Args:
+        files: List of filepaths to L1b, None for missing tiles
+        tiles: List of tiles in the order of files
+        bands (optional): List of bands, default=list(range(1,17))
+        resolution_km (optional): Resolution in km for common grid, default=2
+        dtype (optional): Data type of the returned arrays, default=np.float32
+        cache (optional): cache.ArrayCache of decoded arrays
+    Returns:
+        np.array covering the bounding rectangle of tiles, see mosaic
+    '''
+    return mosaic(load_tiles(files, bands, resolution_km, dtype, cache), tiles)
+
 class GeoNEXL1G(object):
     '''
     Get information on L1G data directory, available tiles, years, and files
-        file lists are locally cached to future reading as retrieving file lists
+        file lists can be kept in a local FileIndex as retrieving file lists
         can be time consuming.
     Args:
         data_directory: directory of the L1G product
@@ -77,56 +530,58 @@ class GeoNEXL1G(object):
     def hours(self):
         return list(range(0,24))
 
+    def catalog(self, tile=None, year=None, days=None, hours=None, index=None):
+        '''
+        Scan the directories of a time range once, or only those which changed if an index is given
+        Args:
+            tile (optional): Tile or list of tiles from GeoNEX grid, all tiles if None
+            year (optional): Year of files to get, all years if None
+            days (optional): Range [first, stop) of days of year, stop excluded as in range()
+            hours (optional): Range [first, last] of hours, last included
+            index (optional): FileIndex to refresh and query instead of listing every directory
+        Returns:
+            pd.DataFrame of filelist with year, dayofyear, hour, minute, file, tile, h, and v
+            sorted by year, dayofyear, hour, minute and tile
+        '''
+        if index is not None:
+            index.refresh(self.data_directory, self.sensor, tile=tile, year=year, days=days)
+            return index.query(self.data_directory, self.sensor, tile=tile, year=year, days=days, hours=hours)
+
+        if tile is None:
+            tile_dirs = [(t, p) for t, p in _subdirs(self.data_directory) if t[0] == 'h']
+        else:
+            tile_dirs = [(t, os.path.join(self.data_directory, t)) for t in _tiles(tile)]
+
+        files = []
+        for _, tile_dir in tile_dirs:
+            for y, year_dir in _subdirs(tile_dir):
+                if not y.isdigit() or (year is not None and int(y) != int(year)):
+                    continue
+                for d, day_dir in _subdirs(year_dir):
+                    if not d.isdigit() or (days is not None and not days[0] <= int(d) < days[1]):
+                        continue
+                    with os.scandir(day_dir) as entries:
+                        files.extend(e.path for e in entries if e.name.endswith('.hdf'))
+
+        fileinfo = parse_files(files)
+        if hours is not None:
+            fileinfo = fileinfo[(fileinfo['hour'] >= hours[0]) & (fileinfo['hour'] <= hours[1])]
+        fileinfo = fileinfo.sort_values(['year', 'dayofyear', 'hour', 'minute', 'tile'])
+        return fileinfo.reset_index(drop=True)
+
     def files(self, tile=None, year=None, dayofyear=None, cachedir='.tmp'):
         '''
         Args:
             tile (optional): Tile from GeoNEX grid
             year (optional): Year of files to get
             dayofyear (optional): Day of year
-            cachedir (optional): Cache filelist in directory
+            cachedir (optional): Directory of the file index, refreshed before every query
         Returns:
             pd.DataFrame of filelist with year, dayofyear, hour, minute, tile, file, h, and v
         '''
-        if tile == None:
-            tile = '*'
-        if year == None:
-            year = '*'
-        else:
-            year = str(year)
-        if dayofyear == None:
-            dayofyear = '*'
-        else:
-            dayofyear = '%03i' % dayofyear
-
-        cache_file = f'{cachedir}/filelist/{self.sat}_{self.sensor}_{tile}_{year}_{dayofyear}.pkl'
-        if os.path.exists(cache_file):
-            return pd.read_pickle(cache_file)
-
-
-        file_pattern = os.path.join(self.data_directory, '%s/%s/%s/*.hdf' % (tile, year, dayofyear))
-        files = glob.glob(file_pattern)
-        fileinfo = []
-        for f in files:
-            root = os.path.dirname(f)
-            rl = root.split('/')
-            doy = int(rl[-1])
-            y = int(rl[-2])
-
-            fl = os.path.basename(f).split('_')
-            hour = int(fl[3][:2])
-            minute = int(fl[3][2:])
-            tile = fl[5]
-            h = int(tile[1:3])
-            v = int(tile[4:6])
-
-            fileinfo.append(dict(year=y, dayofyear=doy, hour=hour,
-                              minute=minute, file=f, tile=tile, h=h, v=v))
-
-        fileinfo = pd.DataFrame(fileinfo)
-        if not os.path.exists(os.path.dirname(cache_file)):
-            os.makedirs(os.path.dirname(cache_file))
-        fileinfo.to_pickle(cache_file)
-        return fileinfo
+        index = FileIndex(os.path.join(cachedir, 'filelist', 'index.sqlite'))
+        days = None if dayofyear is None else (dayofyear, dayofyear + 1)
+        return self.catalog(tile=tile, year=year, days=days, index=index)
 
 class L1GPaired(object):
     def __init__(self, data_path1, data_path2, sensor1, sensor2):
@@ -159,28 +614,95 @@ class L1GPaired(object):
         path1 = os.path.join(self.data_path1, tile, str(year))
         return [int(day) for day in os.listdir(path1)]
 
-    def files(self, tile=None, year=None, dayofyear=None, how='inner', cachedir=''):
+    def files(self, tile=None, year=None, dayofyear=None, how='inner', cachedir='', tolerance=0):
         '''
-        Get filelists for each data directory and join in space-time
+        Get filelists for each data directory and join in space-time. Files of the same tile are
+        paired with the nearest scan of the other sensor within tolerance minutes, as the scan
+        times of GOES-16/17 and Himawari do not align exactly.
 
         Args:
             tile (optional): Tile from GeoNEX grid
             year (optional): Year of files to get
             dayofyear (optional): Day of year
             how (optional): Pandas method to join DataFrames, default='inner'
-            cachedir (optional): Cache filelist in directory
+            cachedir (optional): Directory of the file index
+            tolerance (optional): Largest time difference of paired files in minutes, default=0
         Returns:
-            pd.DataFrame of filelist with year, dayofyear, hour, minute, tile, file, h, and v
+            pd.DataFrame of filelist with year, dayofyear, hour, minute, file, h, and v of each
+            sensor suffixed by 1 and 2, indexed by timestamp in minutes since 1970 and tile
         '''
         files1 = self.data1.files(tile=tile, year=year, dayofyear=dayofyear, cachedir=cachedir)
         files2 = self.data2.files(tile=tile, year=year, dayofyear=dayofyear, cachedir=cachedir)
-        get_timestamp = lambda x: '_'.join(os.path.basename(x).split('_')[2:4])
+        return pair_files(files1, files2, how=how, tolerance=tolerance)
+
+    def catalog(self, tile=None, year=None, days=None, hours=None, tolerance=0, index=None):
+        '''
+        Pairs of files of a time range, see GeoNEXL1G.catalog and files
+
+        Args:
+            tile (optional): Tile from GeoNEX grid, all tiles if None
+            year (optional): Year of files to get, all years if None
+            days (optional): Range [first, stop) of days of year, stop excluded as in range()
+            hours (optional): Range [first, last] of hours, last included
+            tolerance (optional): Largest time difference of paired files in minutes, default=0
+            index (optional): FileIndex to refresh and query instead of listing every directory
+        Returns:
+            pd.DataFrame of filelist like files() with the files of both sensors
+        '''
+        files1 = self.data1.catalog(tile=tile, year=year, days=days, hours=hours, index=index)
+        files2 = self.data2.catalog(tile=tile, year=year, days=days, hours=hours, index=index)
+        return pair_files(files1, files2, how='inner', tolerance=tolerance)
 
-        files1['timestamp'] = files1['file'].apply(get_timestamp)
-        files1 = files1.set_index(['timestamp', 'tile'])
+def pair_files(files1, files2, how='inner', tolerance=0):
+    '''
+    Join two filelists in space-time, files of the same tile are paired with the nearest scan
+    of the other filelist within tolerance minutes
+    Args:
+        files1: pd.DataFrame of filelist of the first sensor
+        files2: pd.DataFrame of filelist of the second sensor
+        how (optional): Pandas method to join DataFrames, default='inner'
+        tolerance (optional): Largest time difference of paired files in minutes, default=0
+    Returns:
+        pd.DataFrame of filelist with year, dayofyear, hour, minute, file, h, and v of each
+        sensor suffixed by 1 and 2, indexed by timestamp in minutes since 1970 and tile
+    '''
+    files1 = _suffixed(files1, '1')
+    files2 = _suffixed(files2, '2')
+
+    if how == 'outer':
+        if tolerance:
+            raise ValueError('Outer joins only pair files with identical timestamps')
+        joined = pd.merge(files1, files2, on=['timestamp', 'tile'], how='outer')
+    else:
+        # sorted nearest neighbour join within each tile, left keeps every file of data1
+        left, right = (files2, files1) if how == 'right' else (files1, files2)
+        joined = pd.merge_asof(left.sort_values('timestamp'), right.sort_values('timestamp'),
+                               on='timestamp', by='tile', direction='nearest',
+                               tolerance=int(tolerance))
+        if how == 'inner':
+            suffix = '2' if left is files1 else '1'
+            joined = joined.dropna(subset=['file' + suffix])
+            for c in ['year', 'dayofyear', 'hour', 'minute', 'h', 'v']:
+                joined[c + suffix] = joined[c + suffix].astype(int)
 
-        files2['timestamp'] = files2['file'].apply(get_timestamp)
-        files2 = files2.set_index(['timestamp', 'tile'])
-        joined = files1.join(files2, lsuffix='1', rsuffix='2', how=how)
-        return joined
+    return joined.set_index(['timestamp', 'tile']).sort_index()
+
+def timestamps(files):
+    '''
+    Vectorized scan times of a filelist
+    Args:
+        files: pd.DataFrame with year, dayofyear, hour and minute
+    Returns:
+        np.array of int64 minutes since 1970
+    '''
+    years = (files['year'].values - 1970).astype('datetime64[Y]')
+    days = years.astype('datetime64[D]') + (files['dayofyear'].values - 1).astype('timedelta64[D]')
+    minutes = files['hour'].values.astype(np.int64) * 60 + files['minute'].values.astype(np.int64)
+    return days.astype(np.int64) * 1440 + minutes
 
+def _suffixed(files, suffix):
+    # filelist with its timestamp, other columns than tile suffixed by the sensor number
+    stamps = timestamps(files)
+    files = files.rename(columns={c: c + suffix for c in files.columns if c != 'tile'})
+    files.insert(0, 'timestamp', stamps)
+    return files
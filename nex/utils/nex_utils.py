@@ -5,7 +5,11 @@
 #
 #                       |> Functions:
 #                           -> scale_rgb (green band scaling)
-#                           -> make_gif   (png images to gif)
+#                           -> render_rgb (rgb array to image)
+#                           -> blend      (weighted composite of arrays)
+#                           -> GifWriter  (streaming gif encoder)
+#                           -> FFmpegWriter (mp4, webm, webp, apng encoder)
+#                           -> open_writer  (encoder of an output format)
 #
 # author          : Will Carrara
 # date            : 03-01-2021
@@ -15,106 +19,394 @@
 # _____________________________________________________________________________
 
 # system handling
+import abc
 import os
-import glob
+import shutil
+import subprocess
+import tempfile
 
 # image handling
-import imageio
-from PIL import ImageEnhance, Image
+from PIL import Image, ImageDraw, ImageFont, GifImagePlugin
 
 # data processing
 import numpy as np
 
-N = M = 600
 MAX_SCALE = 6000
 
-# image directory location
-png_dir = 'images/'
+def _log_stretch_lut(max_in=MAX_SCALE, max_out=255):
+    """Logarithmic stretch of every integer input in [0, max_in] to uint8."""
 
-def scale_rgb(data_b1, data_b2, data_b3):
-    """Logarithmic stretch to match human visual sensibility."""
-
-    max_in = MAX_SCALE
-    max_out = 255
     ref = max_in*0.20          # 10% reflectance as the middle gray
     offset = max_out*0.5       # corresponding to ref
     scale = max_out*0.20/np.log(2.0)  # 20% linear increase for 2x in reflectance
 
-    data_rgb = np.zeros((N, M, 3), 'u1')
-
-    x = np.clip(data_b1, 1, max_in).astype('f4') # 1 will be zero in logarithm
+    x = np.arange(max_in + 1, dtype='f4')
+    x[0] = 1 # 1 will be zero in logarithm
     x = (np.log(x) - np.log(ref))*scale + offset
-    x = np.clip(x, 0, max_out) # 1 will be zero in logarithm
-    data_rgb[:, :, 0] = x.reshape(N, M).astype('u1')
+    x = np.clip(x, 0, max_out)
+    return x.astype('u1')
 
-    x = np.clip(data_b2, 1, max_in).astype('f4') # 1 will be zero in logarithm
-    x = (np.log(x) - np.log(ref))*scale + offset
-    x = np.clip(x, 0, max_out) # 1 will be zero in logarithm
-    data_rgb[:, :, 1] = x.reshape(N, M).astype('u1')
+# stretched value of each input level
+STRETCH_LUT = _log_stretch_lut()
 
-    x = np.clip(data_b3, 1, max_in).astype('f4') # 1 will be zero in logarithm
-    x = (np.log(x) - np.log(ref))*scale + offset
-    x = np.clip(x, 0, max_out) # 1 will be zero in logarithm
-    data_rgb[:, :, 2] = x.reshape(N, M).astype('u1')
+def scale_rgb(data_b1, data_b2, data_b3, out=None, scale=1.):
+    """Logarithmic stretch to match human visual sensibility.
+
+    The stretch is precomputed for every input level in [0, MAX_SCALE], so all three
+    channels are mapped with a single table lookup.
+
+    Args:
+        data_b1, data_b2, data_b3 (np.array): Red, green and blue of shape (H,W) or (H,W,1)
+        out (np.array): Preallocated uint8 array of shape (H,W,3) to fill
+        scale (float): Factor applied to the inputs first, e.g. 10000 for reflectances
+
+    Returns:
+        data_rgb (np.array): uint8 array of shape (H,W,3)
+    """
+
+    shape = np.shape(data_b1)[:2]
+    if out is None:
+        out = np.empty(shape + (3,), 'u1')
+
+    # input levels rounded to the nearest table entry
+    x = np.empty(shape + (3,), 'f4')
+    for i, data in enumerate((data_b1, data_b2, data_b3)):
+        np.multiply(np.reshape(data, shape), scale, out=x[:, :, i])
+    x += 0.5
+    np.minimum(x, MAX_SCALE, out=x)
+
+    # negative levels and nan are clipped to the start of the table
+    with np.errstate(invalid='ignore'):
+        index = x.astype(np.intp)
+    np.take(STRETCH_LUT, index, mode='clip', out=out)
+    return out
+
+def enhance_contrast(rgb, factor):
+    """Vectorized equivalent of PIL.ImageEnhance.Contrast on an 8-bit array.
+
+    Args:
+        rgb (np.array): uint8 array of shape (H,W,3)
+        factor (float): Contrast factor, 1 returns the original image
+
+    Returns:
+        rgb (np.array): Enhanced uint8 array
+    """
+
+    # mean of the ITU-R 601-2 luma, as PIL's L mode conversion
+    luma = (rgb[:,:,0] * np.uint32(19595) + rgb[:,:,1] * np.uint32(38470)
+            + rgb[:,:,2] * np.uint32(7471) + np.uint32(0x8000)) >> 16
+    mean = int(luma.mean() + 0.5)
+
+    # blend towards the mean grey, truncated and clipped like PIL
+    x = rgb.astype(np.float32)
+    x -= mean
+    x *= factor
+    x += mean
+    np.clip(x, 0, 255, out=x)
+    return x.astype(np.uint8)
+
+def render_rgb(rgb, label=None, gamma=0.5, font_size=None, contrast=None):
+    """Render a reflectance rgb array at native resolution.
+
+    Args:
+        rgb (np.array): Array of shape (H,W,3) with values in [0,1], values outside are clipped,
+            or an already stretched uint8 array which is used as is
+        label (str): Text drawn in the bottom right corner
+        gamma (float): Exponent applied to the reflectances, unused for uint8 arrays
+        font_size (int): Size of the label in pixels, scales with the image by default
+        contrast (float): Contrast enhancement factor, as PIL.ImageEnhance.Contrast
+
+    Returns:
+        image (PIL.Image): 8-bit rgb image
+    """
+
+    if rgb.dtype == np.uint8:
+        x = rgb
+    else:
+        # vectorized gamma and scaling to 8-bit
+        x = np.nan_to_num(rgb, nan=0.).astype(np.float32)
+        np.clip(x, 0., 1., out=x)
+        np.power(x, gamma, out=x)
+        x *= 255.
+        x += 0.5
+        x = x.astype(np.uint8)
+    if contrast is not None:
+        x = enhance_contrast(x, contrast)
+    image = Image.fromarray(x, 'RGB')
+
+    if label:
+        height, width = x.shape[:2]
+        if font_size is None:
+            font_size = max(10, height // 36)
+        try:
+            font = ImageFont.load_default(font_size)
+        except TypeError:
+            # Pillow < 10.1 only has a fixed size bitmap font
+            font = ImageFont.load_default()
+        draw = ImageDraw.Draw(image)
+        draw.text((width * 0.95, height * 0.99), label, fill='white', font=font, anchor='rb')
+
+    return image
+
+def blend(arrays, weights):
+    """Weighted mean of co-registered arrays, e.g. frames of overlapping sensors.
+
+    Pixels which are nan in some arrays are taken from the others, pixels which are nan
+    in all arrays stay nan.
+
+    Args:
+        arrays (list): np.arrays of the same shape (H,W,C)
+        weights (list): np.arrays broadcastable to (H,W,C), e.g. of shape (H,W,1)
+
+    Returns:
+        composite (np.array): float32 array of shape (H,W,C)
+    """
+
+    total = np.zeros(arrays[0].shape, np.float32)
+    norm = np.zeros(arrays[0].shape, np.float32)
+    for a, weight in zip(arrays, weights):
+        valid = ~np.isnan(a)
+        weight = np.where(valid, weight, 0.)
+        total += np.where(valid, a, 0.) * weight
+        norm += weight
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / norm
+
+# output formats with their file extension
+FORMATS = {'gif': '.gif', 'mp4': '.mp4', 'webm': '.webm', 'webp': '.webp', 'apng': '.png'}
+
+class FrameWriter(abc.ABC):
+    """Base class of the streaming encoders, frames are appended one at a time."""
+
+    @abc.abstractmethod
+    def append(self, frame):
+        """Encode the next frame, a PIL image or an (H,W,3) uint8 array."""
+
+    @abc.abstractmethod
+    def close(self):
+        """Finish the output file."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _as_image(frame):
+    # 8-bit rgb PIL image from an image or an array
+    image = frame if isinstance(frame, Image.Image) else Image.fromarray(np.asarray(frame, np.uint8))
+    return image.convert('RGB')
+
+class GifWriter(FrameWriter):
+    """Appends frames to an animated .gif file as they are produced, so memory stays
+    constant whatever the number of frames.
+
+    Args:
+        path (str): Output file path
+        duration (float): Display time of each frame in seconds
+        loop (int): Number of loops, 0 loops forever
+        reuse_palette (bool): Map every frame to the palette of the first frame instead of
+            quantizing each frame, faster and without colour flicker between frames
+
+    Examples:
+        >>> with GifWriter('output/fire.gif') as writer:
+        ...     for image in images: writer.append(image)
+    """
+
+    def __init__(self, path, duration=.1, loop=0, reuse_palette=False):
+        self.path = path
+        self.duration = int(round(duration * 1000))
+        self.loop = loop
+        self.reuse_palette = reuse_palette
+        self.palette = None
+        self.count = 0
+        self.fp = open(path, 'wb')
+
+    def append(self, frame):
+        """Quantize and encode a single frame.
+
+        Args:
+            frame (PIL.Image or np.array): 8-bit rgb image of shape (H,W,3)
+        """
+
+        image = _as_image(frame)
+
+        if self.palette is not None:
+            indexed = image.quantize(palette=self.palette)
+        else:
+            indexed = image.quantize(256)
+
+        if self.count == 0:
+            # the palette of the first frame is the global colour table
+            header, _ = GifImagePlugin.getheader(indexed, info=dict(loop=self.loop, duration=self.duration))
+            self.fp.write(b''.join(header))
+            if self.reuse_palette:
+                self.palette = indexed
+
+        # later frames with their own palette carry a local colour table
+        local = self.count > 0 and self.palette is None
+        for data in GifImagePlugin.getdata(indexed, duration=self.duration, include_color_table=local):
+            self.fp.write(data)
+        self.count += 1
+
+    def close(self):
+        """Write the trailer and close the file."""
+
+        if self.fp.closed:
+            return
+        self.fp.write(b';')
+        self.fp.close()
+
+class FFmpegWriter(FrameWriter):
+    """Pipes raw frames to a local ffmpeg binary, which encodes them as they arrive.
+
+    Args:
+        path (str): Output file path
+        format (str): One of mp4 (H.264), webm (VP9), webp or apng
+        fps (float): Frames per second
+        quality (int): 0-100, higher is better, the encoder default if None
+        loop (int): Number of loops of webp and apng, 0 loops forever
+        ffmpeg (str): ffmpeg executable
+    """
 
-    return data_rgb
+    def __init__(self, path, format='mp4', fps=10, quality=None, loop=0, ffmpeg='ffmpeg'):
+        if format not in ('mp4', 'webm', 'webp', 'apng'):
+            raise ValueError(f'Unsupported ffmpeg output format {format}')
+        self.path = path
+        self.format = format
+        self.fps = fps
+        self.quality = quality
+        self.loop = loop
+        self.ffmpeg = ffmpeg
+        self.process = None
+        self.size = None
 
+    def _codec_args(self):
+        # crf of the video codecs decreases with quality, from lossless to worst
+        q = self.quality
+        if self.format == 'mp4':
+            args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-movflags', '+faststart']
+            args += ['-crf', str(round(51 * (100 - q) / 100))] if q is not None else []
+        elif self.format == 'webm':
+            args = ['-c:v', 'libvpx-vp9', '-pix_fmt', 'yuv420p', '-b:v', '0',
+                    '-crf', str(round(63 * (100 - q) / 100)) if q is not None else '32']
+        elif self.format == 'webp':
+            args = ['-c:v', 'libwebp_anim', '-loop', str(self.loop)]
+            args += ['-quality', str(q)] if q is not None else []
+        else:
+            args = ['-c:v', 'apng', '-plays', str(self.loop), '-f', 'apng']
+        if self.format in ('mp4', 'webm'):
+            # 4:2:0 chroma subsampling needs even dimensions
+            args += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        return args
 
+    def _open(self, size):
+        self.size = size
+        self.log = tempfile.TemporaryFile()
+        command = [self.ffmpeg, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % size, '-r', str(self.fps),
+                   '-i', '-'] + self._codec_args() + [self.path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.log)
 
-def color_fix():
-    """Apply color enhancement."""
+    def append(self, frame):
+        """Send a single frame to the encoder.
 
-    # loop through images
-    for file_name in sorted(os.listdir(png_dir)):
-       if file_name.endswith('.png'):
-          file_path = os.path.join(png_dir, file_name)
-          # read image
-          image = Image.open(file_path)
+        Args:
+            frame (PIL.Image or np.array): 8-bit rgb image of shape (H,W,3)
+        """
 
-          # increase contrast
-          enhancer = ImageEnhance.Contrast(image)
-          image = enhancer.enhance(1.75)
+        image = _as_image(frame)
+        if self.process is None:
+            self._open(image.size)
+        if image.size != self.size:
+            raise ValueError(f'Frame has size {image.size}, expected {self.size}')
+        try:
+            self.process.stdin.write(image.tobytes())
+        except BrokenPipeError:
+            self._check(self.process.wait())
 
-          # overwrite image
-          image = image.save(png_dir+'/'+file_name)
+    def close(self):
+        """Flush the encoder and wait for ffmpeg to finish."""
 
+        if self.process is None or self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._check(self.process.wait())
+        self.log.close()
 
-def color_fix():
-    """Apply color enhancement."""
+    def _check(self, returncode):
+        if returncode != 0:
+            self.log.seek(0)
+            message = self.log.read().decode(errors='replace').strip()
+            raise RuntimeError(f'ffmpeg failed to encode {self.path}: {message}')
 
-    # loop through images
-    for file_name in sorted(os.listdir(png_dir)):
-       if file_name.endswith('.png'):
-          file_path = os.path.join(png_dir, file_name)
-          
-          # read image
-          image = Image.open(file_path)
+class PillowWriter(FrameWriter):
+    """Animated webp or apng through Pillow, for machines without ffmpeg. Pillow encodes
+    all frames at once, so they are kept in memory until close.
 
-          # increase contrast
-          enhancer = ImageEnhance.Contrast(image)
-          image = enhancer.enhance(1.75)
+    Args:
+        path (str): Output file path
+        format (str): webp or apng
+        fps (float): Frames per second
+        quality (int): 0-100 webp quality, higher is better, the encoder default if None
+        loop (int): Number of loops, 0 loops forever
+    """
 
-          # overwrite image
-          image = image.save(png_dir+'/'+file_name)
+    def __init__(self, path, format='webp', fps=10, quality=None, loop=0):
+        if format not in ('webp', 'apng'):
+            raise ValueError(f'Unsupported Pillow output format {format}')
+        self.path = path
+        self.format = format
+        self.fps = fps
+        self.quality = quality
+        self.loop = loop
+        self.frames = []
 
-def make_gif(name):
-    """ Generate .gif file."""
+    def append(self, frame):
+        self.frames.append(_as_image(frame))
 
-    # empty image list
-    images = []
+    def close(self):
+        if not self.frames:
+            return
+        options = dict(save_all=True, append_images=self.frames[1:],
+                       duration=int(round(1000 / self.fps)), loop=self.loop)
+        if self.format == 'webp':
+            if self.quality is not None:
+                options['quality'] = self.quality
+            self.frames[0].save(self.path, 'WEBP', **options)
+        else:
+            self.frames[0].save(self.path, 'PNG', **options)
+        self.frames = []
 
-    for file_name in sorted(os.listdir(png_dir)):
-       if file_name.endswith('.png'):
-           file_path = os.path.join(png_dir, file_name)
-           images.append(imageio.imread(file_path))
+def open_writer(name, format='gif', fps=10, quality=None, reuse_palette=False, output_dir='output',
+                ffmpeg='ffmpeg'):
+    """Streaming encoder of an animation.
 
-    # save as .gif
-    imageio.mimsave('output/'+name+'.gif', images, duration=.1)
+    Args:
+        name (str): Output file name without extension
+        format (str): Output format, one of gif, mp4, webm, webp or apng
+        fps (float): Frames per second
+        quality (int): 0-100, higher is better, ignored by gif and apng
+        reuse_palette (bool): Use the palette of the first frame for every gif frame
+        output_dir (str): Directory of the output file
+        ffmpeg (str): ffmpeg executable, webp and apng fall back to Pillow if it is not found
 
+    Returns:
+        writer (FrameWriter): Encoder with append and close methods
+    """
 
-def empty_dir():
-    """Remove old images."""
+    if format not in FORMATS:
+        raise ValueError(f'Unknown output format {format}, expected one of {list(FORMATS)}')
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, name + FORMATS[format])
 
-    # resulted images
-    files = glob.glob('images/*.png')
-    for f in files: os.remove(f)
+    if format == 'gif':
+        return GifWriter(path, duration=1./fps, reuse_palette=reuse_palette)
+    if shutil.which(ffmpeg) is not None:
+        return FFmpegWriter(path, format=format, fps=fps, quality=quality, ffmpeg=ffmpeg)
+    if format in ('webp', 'apng'):
+        return PillowWriter(path, format=format, fps=fps, quality=quality)
+    raise RuntimeError(f'Encoding {format} requires ffmpeg, {ffmpeg} was not found')
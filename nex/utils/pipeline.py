@@ -0,0 +1,132 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# marks the end of a stage's output
+_DONE = object()
+
+def stream(items, load, translate, render, sink, load_executor=None, render_executor=None,
+           batch_size=4, depth=8, buffers=None):
+    '''
+    Staged streaming pipeline: loaders -> batched translation -> renderers -> sink. Stages are
+    connected by bounded queues so at most about depth frames are in flight per stage, and the
+    throughput approaches the one of the slowest stage. Items reach the sink in input order.
+    Args:
+        items (iterable): Work items, e.g. rows of a file list
+        load (callable): Maps an item to its data, run in load_executor
+        translate (callable): Maps lists of items and their data to a list of predictions,
+            run in one thread
+        render (callable): Maps (item, data, prediction) to a frame, run in render_executor
+        sink (callable): Consumes each frame in order, run in the calling thread
+        load_executor (optional): concurrent.futures Executor for load, default one thread
+        render_executor (optional): concurrent.futures Executor for render, default one thread
+        batch_size (int): Number of data per translate call
+        depth (int): Capacity of the queues between stages
+        buffers (optional): Preallocated arrays recycled as the out argument of load, e.g. a ring
+            of depth + batch_size frames. Each item holds one from its load until its render is
+            done, so at least batch_size + 1 are needed, and the executors must share memory
+            with the caller, i.e. not be process pools
+    '''
+    if buffers is not None and len(buffers) <= batch_size:
+        raise ValueError(f'{len(buffers)} buffers cannot hold a batch of {batch_size} and the next frame')
+
+    own = []
+    if load_executor is None:
+        load_executor = ThreadPoolExecutor(1)
+        own.append(load_executor)
+    if render_executor is None:
+        render_executor = ThreadPoolExecutor(1)
+        own.append(render_executor)
+
+    loaded = queue.Queue(depth)
+    rendered = queue.Queue(depth)
+    stop = threading.Event()
+
+    # buffers not held by any item
+    free = None
+    if buffers is not None:
+        free = queue.Queue()
+        for buffer in buffers:
+            free.put(buffer)
+
+    def put(q, value):
+        # give up when the consumer stopped, instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def feed():
+        try:
+            for item in items:
+                if free is None:
+                    buffer, future = None, load_executor.submit(load, item)
+                else:
+                    buffer = get(free)
+                    if buffer is _DONE:
+                        return
+                    future = load_executor.submit(load, item, out=buffer)
+                if not put(loaded, (item, future, buffer)):
+                    return
+        except BaseException as e:
+            put(loaded, (None, _failed(e), None))
+        put(loaded, _DONE)
+
+    def infer():
+        try:
+            done = False
+            while not done:
+                batch = []
+                while len(batch) < batch_size:
+                    entry = get(loaded)
+                    if entry is _DONE:
+                        done = True
+                        break
+                    item, future, buffer = entry
+                    batch.append((item, future.result(), buffer))
+                if not batch:
+                    break
+                predictions = translate([item for item, _, _ in batch], [data for _, data, _ in batch])
+                for (item, data, buffer), prediction in zip(batch, predictions):
+                    future = render_executor.submit(render, item, data, prediction)
+                    if buffer is not None:
+                        # the frame is free to be loaded over once it is rendered
+                        future.add_done_callback(lambda _, buffer=buffer: free.put(buffer))
+                    if not put(rendered, future):
+                        return
+        except BaseException as e:
+            put(rendered, _failed(e))
+        put(rendered, _DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=infer, daemon=True)]
+    for t in threads:
+        t.start()
+    try:
+        while True:
+            future = rendered.get()
+            if future is _DONE:
+                break
+            sink(future.result())
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        for executor in own:
+            executor.shutdown()
+
+def _failed(e):
+    # future carrying an exception to the next stage
+    future = Future()
+    future.set_exception(e)
+    return future
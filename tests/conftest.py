@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules import each other relative to the nex directory, as when running animate.py from it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'nex'))
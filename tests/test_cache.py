@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+from utils.cache import ArrayCache
+
+def entry(n):
+    # array of n kilobytes
+    return np.arange(n * 256, dtype=np.float32)
+
+def age(cache, key, mtime):
+    os.utime(cache.path(key), (mtime, mtime))
+
+def test_put_get(tmp_path):
+    cache = ArrayCache(str(tmp_path / 'cache'))
+    assert cache.get('a') is None
+    stored = cache.put(('a', 1), entry(1))
+    np.testing.assert_array_equal(stored, entry(1))
+    hit = cache.get(('a', 1))
+    np.testing.assert_array_equal(hit, entry(1))
+    assert isinstance(hit, np.memmap) and not hit.flags.writeable
+    assert cache.get(('a', 2)) is None
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ArrayCache(str(tmp_path), max_bytes=3500)
+    for i, key in enumerate('abc'):
+        cache.put(key, entry(1))
+        age(cache, key, 1e9 + i)
+    # a hit makes the oldest entry the most recently used
+    cache.get('a')
+    cache.put('d', entry(1))
+    assert cache.get('b') is None
+    for key in 'acd':
+        assert cache.get(key) is not None
+
+def test_entry_larger_than_budget(tmp_path):
+    cache = ArrayCache(str(tmp_path), max_bytes=2000)
+    cache.put('small', entry(1))
+    age(cache, 'small', 1e9)
+    stored = cache.put('large', entry(4))
+    # the entry just stored is returned and kept, everything else is evicted
+    np.testing.assert_array_equal(stored, entry(4))
+    assert cache.get('small') is None
+    assert cache.get('large') is not None
+    age(cache, 'large', 1e9)
+    cache.put('next', entry(1))
+    assert cache.get('large') is None
+    assert cache.get('next') is not None
+
+def test_max_age(tmp_path):
+    cache = ArrayCache(str(tmp_path), max_age=60)
+    cache.put('old', entry(1))
+    age(cache, 'old', 1e9)
+    cache.put('new', entry(1))
+    # expiry is checked by puts at most once per max_age
+    assert os.path.exists(cache.path('old'))
+    cache._evicted -= 60
+    cache.put('newer', entry(1))
+    assert cache.get('old') is None
+    assert cache.get('new') is not None
+
+def test_size_is_tracked_without_scanning(tmp_path, monkeypatch):
+    cache = ArrayCache(str(tmp_path), max_bytes=100000)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda keep=None: scans.append(keep) or evict(keep=keep))
+    for i in range(10):
+        cache.put(i, entry(1))
+    # only the first put scans the directory to learn its size
+    assert len(scans) == 1
+    assert cache._size == sum(os.path.getsize(cache.path(i)) for i in range(10))
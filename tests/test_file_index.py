@@ -0,0 +1,69 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from utils.geonexl1g import FileIndex, GeoNEXL1G
+
+def touch(root, tile, year, doy, hhmm, date='20200904'):
+    directory = os.path.join(root, tile, str(year), '%03i' % doy)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'GO17_ABI12B_%s_%s_GLBG_%s_02.hdf' % (date, hhmm, tile))
+    open(path, 'w').close()
+    return path
+
+def settle(root, mtime=1e9):
+    # directories modified within the last seconds are listed again on every refresh
+    for directory, _, _ in os.walk(root):
+        os.utime(directory, (mtime, mtime))
+
+@pytest.fixture
+def collection(tmp_path):
+    root = str(tmp_path / 'GEONEX-L1G')
+    for tile in ['h09v03', 'h10v03']:
+        for doy in [247, 248]:
+            for hhmm in ['1500', '1510', '1600']:
+                touch(root, tile, 2020, doy, hhmm)
+    os.makedirs(os.path.join(root, 'h09v03', 'notes'))
+    touch(root, 'h09v03', 2019, 248, '1500')
+    settle(root)
+    return root
+
+def assert_matches(index, geo, **kwargs):
+    expected = geo.catalog(**kwargs)
+    result = geo.catalog(index=index, **kwargs)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    return result
+
+@pytest.mark.parametrize('kwargs', [dict(),
+                                    dict(tile='h09v03'),
+                                    dict(tile=['h10v03', 'h09v03'], year=2020, days=(248, 249)),
+                                    dict(year=2020, hours=(15, 15))])
+def test_query_matches_catalog(tmp_path, collection, kwargs):
+    index = FileIndex(str(tmp_path / 'index' / 'index.sqlite'))
+    result = assert_matches(index, GeoNEXL1G(collection, 'G17'), **kwargs)
+    assert len(result) > 0
+
+def test_refresh_lists_changed_directories_only(tmp_path, collection):
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    geo = GeoNEXL1G(collection, 'G17')
+    assert index.refresh(collection, 'G17') > 0
+    assert index.refresh(collection, 'G17') == 0
+
+    touch(collection, 'h09v03', 2020, 247, '1700')
+    shutil.rmtree(os.path.join(collection, 'h10v03', '2020', '248'))
+    touch(collection, 'h10v03', 2020, 249, '1500', date='20200905')
+    for path in ['h09v03/2020/247', 'h10v03/2020', 'h10v03/2020/249']:
+        os.utime(os.path.join(collection, path), (2e9, 2e9))
+    # day 247 of h09v03, 2020 of h10v03 and its new day 249
+    assert index.refresh(collection, 'G17') == 3
+    result = assert_matches(index, geo)
+    assert not result['file'].str.contains(os.path.join('h10v03', '2020', '248')).any()
+
+def test_removed_collection(tmp_path, collection):
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    index.refresh(collection, 'G17')
+    shutil.rmtree(collection)
+    index.refresh(collection, 'G17')
+    assert len(index.query(collection)) == 0
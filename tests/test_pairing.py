@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.geonexl1g import FileIndex, L1GPaired, pair_files, parse_files
+
+def path(root, tile, hhmm, doy=248, sensor='GO17'):
+    return os.path.join(root, tile, '2020', '%03i' % doy, '%s_ABI12B_20200904_%s_GLBG_%s_02.hdf' % (sensor, hhmm, tile))
+
+def filelist(root, scans, sensor='GO17'):
+    return parse_files([path(root, tile, hhmm, sensor=sensor) for tile, hhmm in scans])
+
+@pytest.fixture
+def files():
+    files1 = filelist('/g17', [('h09v03', '1500'), ('h09v03', '1510'), ('h10v03', '1500'), ('h09v03', '1600')])
+    files2 = filelist('/g16', [('h09v03', '1502'), ('h09v03', '1508'), ('h10v03', '1520'), ('h09v03', '1700')],
+                      sensor='GO16')
+    return files1, files2
+
+def times(joined):
+    # scan times of the pairs as (tile, hhmm of sensor 1, hhmm of sensor 2)
+    def hhmm(f):
+        return f.split('_')[3] if isinstance(f, str) else None
+    return [(tile, hhmm(f1), hhmm(f2)) for (_, tile), f1, f2
+            in zip(joined.index, joined['file1'], joined['file2'])]
+
+def test_nearest_within_tolerance(files):
+    joined = pair_files(*files, tolerance=5)
+    assert times(joined) == [('h09v03', '1500', '1502'), ('h09v03', '1510', '1508')]
+    for c in ['year', 'dayofyear', 'hour', 'minute', 'h', 'v']:
+        assert joined[c + '1'].dtype == np.int64 and joined[c + '2'].dtype == np.int64
+
+def test_beyond_tolerance(files):
+    assert len(pair_files(*files)) == 0
+    assert len(pair_files(*files, tolerance=1)) == 0
+    # the scan of the other tile is never paired whatever the tolerance
+    joined = pair_files(*files, tolerance=30)
+    assert ('h10v03', '1500', '1520') in times(joined)
+    assert all(tile == f.split('_')[-2] for (_, tile), f in zip(joined.index, joined['file2']))
+
+def test_left_and_right(files):
+    left = pair_files(*files, how='left', tolerance=5)
+    assert times(left) == [('h09v03', '1500', '1502'), ('h10v03', '1500', None),
+                           ('h09v03', '1510', '1508'), ('h09v03', '1600', None)]
+    right = pair_files(*files, how='right', tolerance=5)
+    assert times(right) == [('h09v03', '1500', '1502'), ('h09v03', '1510', '1508'),
+                            ('h10v03', None, '1520'), ('h09v03', None, '1700')]
+
+def test_outer(files):
+    files1, files2 = files
+    joined = pair_files(files1, files1.iloc[[0, 2]], how='outer')
+    assert times(joined) == [('h09v03', '1500', '1500'), ('h10v03', '1500', '1500'),
+                             ('h09v03', '1510', None), ('h09v03', '1600', None)]
+    assert len(pair_files(*files, how='outer')) == 8
+    with pytest.raises(ValueError):
+        pair_files(*files, how='outer', tolerance=5)
+
+@pytest.mark.parametrize('how', ['inner', 'left', 'right'])
+def test_empty(files, how):
+    empty = parse_files([])
+    for files1, files2 in [(empty, empty), (files[0], empty), (empty, files[1])]:
+        joined = pair_files(files1, files2, how=how, tolerance=5)
+        expected = {'inner': 0, 'left': len(files1), 'right': len(files2)}[how]
+        assert len(joined) == expected
+
+@pytest.mark.parametrize('days', [(248, 249), (1, 2)])
+def test_catalog_and_index(tmp_path, days):
+    root1, root2 = str(tmp_path / 'G17'), str(tmp_path / 'G16')
+    for root, sensor, hhmm in [(root1, 'GO17', '1500'), (root2, 'GO16', '1502')]:
+        f = path(root, 'h09v03', hhmm, sensor=sensor)
+        os.makedirs(os.path.dirname(f))
+        open(f, 'w').close()
+    os.makedirs(os.path.join(root2, 'h09v03', '2020', '001'))
+
+    paired = L1GPaired(root1, root2, 'G17', 'G16')
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    expected = paired.catalog(tile='h09v03', year=2020, days=days, tolerance=5)
+    result = paired.catalog(tile='h09v03', year=2020, days=days, tolerance=5, index=index)
+    assert len(result) == (1 if days[0] == 248 else 0)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_index_type=False)
+    files = paired.files(tile='h09v03', year=2020, dayofyear=days[0], tolerance=5, cachedir=str(tmp_path))
+    assert len(files) == len(result)
@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from model import inference, utils
+from model.network import SplitGenVAE
+
+PARAMS = os.path.join(os.path.dirname(utils.__file__), 'params.yaml')
+
+@pytest.mark.parametrize('shape,patch_size,overlap,margin', [((130, 170), 64, 16, 8),
+                                                             ((130, 170), 64, 0, 0),
+                                                             ((128, 128), 64, 16, 0),
+                                                             ((100, 90), 50, 49, 24),
+                                                             ((64, 200), 64, 20, 5)])
+def test_stitch_identity(shape, patch_size, overlap, margin):
+    x = np.random.default_rng(0).standard_normal(shape + (3,)).astype(np.float32)
+    patches = utils.iter_patches(x, patch_size, overlap)
+    out = utils.stitch_patches(patches, shape, patch_size, overlap, margin)
+    np.testing.assert_allclose(out, x, rtol=1e-5, atol=1e-5)
+
+def test_make_patches():
+    x = np.arange(40 * 50 * 2).reshape(40, 50, 2)
+    patches = utils.make_patches(x, 20, 4)
+    assert patches.shape == (len(utils.patch_origins(40, 20, 4)) * len(utils.patch_origins(50, 20, 4)), 20, 20, 2)
+    np.testing.assert_array_equal(patches[-1], x[-20:, -20:])
+
+@pytest.mark.parametrize('patch_size,overlap,margin', [(64, 64, 0), (64, -1, 0), (64, 16, 9), (0, 0, 0)])
+def test_invalid_arguments(patch_size, overlap, margin):
+    with pytest.raises(ValueError):
+        utils.check_patches(patch_size, overlap, margin)
+
+@pytest.mark.parametrize('n_res', [1, 4])
+def test_receptive_radius(n_res):
+    params = utils.get_config(PARAMS)
+    params['gen']['n_res'] = n_res
+    model = SplitGenVAE(params).eval().double()
+    x = torch.randn(1, 16, 81, 81, dtype=torch.float64, requires_grad=True)
+    z, _ = model.encode(x, 'G17', noise=False)
+    model.decode(z, 'H8', skip_x=x[:, model.skip_dim])[0, :, 40, 40].sum().backward()
+    rows = np.flatnonzero(x.grad.abs().sum((0, 1, 3)).numpy())
+    assert 40 - rows.min() == rows.max() - 40 == utils.receptive_radius(params)
+
+def test_tiled_matches_whole_frame():
+    torch.manual_seed(0)
+    params = utils.get_config(PARAMS)
+    model = SplitGenVAE(params).eval()
+    mu, sd = utils.get_sensor_stats('G17')
+    rng = np.random.default_rng(0)
+    data = (np.array(mu) + np.array(sd) * rng.standard_normal((100, 140, 16))).astype(np.float32)
+    full = inference.domain_to_domain(model, data, 'G17', 'H8', bands2=[1, 2], device='cpu')
+    tiled = inference.tiled_domain_to_domain(model, data, 'G17', 'H8', bands2=[1, 2], device='cpu',
+                                             patch_size=64, overlap=2 * utils.receptive_radius(params),
+                                             batch_size=3)
+    np.testing.assert_allclose(tiled, full, rtol=1e-4, atol=1e-4)
+
+def test_mosaic_matches_whole_frame():
+    from utils import geonexl1g
+
+    torch.manual_seed(0)
+    params = utils.get_config(PARAMS)
+    model = SplitGenVAE(params).eval()
+    mu, sd = utils.get_sensor_stats('G17')
+    rng = np.random.default_rng(1)
+    tiles = ['h09v03', 'h10v03', 'h09v04']
+    arrays = [(np.array(mu) + np.array(sd) * rng.standard_normal((60, 60, 16))).astype(np.float32)
+              for _ in tiles] + [None]
+    data = geonexl1g.mosaic(arrays, tiles + ['h10v04'])
+    radius = utils.receptive_radius(params)
+    whole = inference.domain_to_domain(model, np.nan_to_num(data), 'G17', 'H8', bands2=[1], device='cpu')
+    tiled = inference.tiled_domain_to_domain(model, data, 'G17', 'H8', bands2=[1], device='cpu',
+                                             patch_size=60, overlap=2 * radius, batch_size=4)
+    # the seams between the three tiles, away from the missing fourth one
+    seams = (slice(0, 60 - radius), slice(60 - radius, 60 + radius)), (slice(60 - radius, 60 + radius), slice(0, 60 - radius))
+    for rows, cols in seams:
+        np.testing.assert_allclose(tiled[rows, cols], whole[rows, cols], rtol=1e-4, atol=1e-4)
+    # translating each tile on its own does not
+    single = inference.domain_to_domain(model, arrays[0], 'G17', 'H8', bands2=[1], device='cpu')
+    assert np.abs(single[:60 - radius, 60 - radius:] - whole[:60 - radius, 60 - radius:60]).max() > 1e-3
@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from utils.pipeline import stream
+
+def jitter():
+    time.sleep(random.random() * 0.002)
+
+def load(item):
+    jitter()
+    return item * 10
+
+def translate(items, data):
+    jitter()
+    return [d + 1 for d in data]
+
+def render(item, data, prediction):
+    jitter()
+    return (item, data, prediction)
+
+@pytest.mark.parametrize('batch_size,depth', [(1, 1), (3, 2), (4, 8)])
+def test_order(batch_size, depth):
+    frames, batches = [], []
+
+    def record(items, data):
+        batches.append(len(items))
+        return translate(items, data)
+
+    with ThreadPoolExecutor(4) as loaders, ThreadPoolExecutor(3) as renderers:
+        stream(range(50), load, record, render, frames.append, load_executor=loaders,
+               render_executor=renderers, batch_size=batch_size, depth=depth)
+    assert frames == [(i, i * 10, i * 10 + 1) for i in range(50)]
+    assert sum(batches) == 50 and max(batches) <= batch_size
+
+def test_empty():
+    frames = []
+    stream([], load, translate, render, frames.append)
+    assert frames == []
+
+def fail_at(n, f):
+    # raise on the n-th call
+    calls = iter(range(1, n + 1))
+    def wrapped(*args):
+        if next(calls, n) == n:
+            raise RuntimeError('stage failed')
+        return f(*args)
+    return wrapped
+
+def items_failing():
+    yield from range(5)
+    raise RuntimeError('stage failed')
+
+@pytest.mark.parametrize('stage', ['items', 'load', 'translate', 'render', 'sink'])
+def test_errors_propagate(stage):
+    stages = dict(items=range(100), load=load, translate=translate, render=render, sink=lambda frame: None)
+    stages[stage] = items_failing() if stage == 'items' else fail_at(7, stages[stage])
+    before = threading.active_count()
+    with pytest.raises(RuntimeError, match='stage failed'):
+        stream(stages['items'], stages['load'], stages['translate'], stages['render'], stages['sink'],
+               batch_size=2, depth=2)
+    # the stage threads and default executors are stopped before the error reaches the caller
+    assert threading.active_count() == before
+
+def test_buffers_are_recycled():
+    buffers = [np.full(3, -1) for _ in range(5)]
+    used = set()
+
+    def load_into(item, out):
+        jitter()
+        used.add(id(out))
+        out[...] = item
+        return out
+
+    def render_copy(item, data, prediction):
+        jitter()
+        # the buffer of an item is not loaded over before it is rendered
+        assert (data == item).all()
+        return int(data[0])
+
+    frames = []
+    with ThreadPoolExecutor(3) as loaders, ThreadPoolExecutor(3) as renderers:
+        stream(range(40), load_into, lambda items, data: [None] * len(data), render_copy, frames.append,
+               load_executor=loaders, render_executor=renderers, batch_size=3, depth=2, buffers=buffers)
+    assert frames == list(range(40))
+    assert used <= set(id(b) for b in buffers)
+
+def test_too_few_buffers():
+    with pytest.raises(ValueError):
+        stream(range(4), load, translate, render, lambda frame: None, batch_size=2,
+               buffers=[np.empty(3), np.empty(3)])
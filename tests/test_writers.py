@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from utils.nex_utils import FrameWriter, GifWriter, open_writer
+
+def frames(n):
+    # every frame uses the same colours in a different arrangement, so a shared palette is exact
+    colours = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 255]], dtype=np.uint8)
+    return [colours[(np.add.outer(np.arange(16), np.arange(24)) // 4 + i) % 4] for i in range(n)]
+
+@pytest.mark.parametrize('reuse_palette', [False, True])
+@pytest.mark.parametrize('loop', [0, 3])
+def test_gif(tmp_path, reuse_palette, loop):
+    path = str(tmp_path / 'out.gif')
+    expected = frames(5)
+    with GifWriter(path, duration=.25, loop=loop, reuse_palette=reuse_palette) as writer:
+        for i, frame in enumerate(expected):
+            # arrays and images are both accepted
+            writer.append(frame if i % 2 else Image.fromarray(frame))
+
+    with Image.open(path) as gif:
+        assert gif.n_frames == 5
+        assert gif.info['loop'] == loop
+        for frame, image in zip(expected, ImageSequence.Iterator(gif)):
+            assert image.info['duration'] == 250
+            np.testing.assert_array_equal(np.asarray(image.convert('RGB')), frame)
+
+def test_open_writer(tmp_path):
+    with open_writer('anim', fps=4, output_dir=str(tmp_path)) as writer:
+        assert isinstance(writer, GifWriter)
+        for frame in frames(2):
+            writer.append(frame)
+    with Image.open(str(tmp_path / 'anim.gif')) as gif:
+        assert gif.n_frames == 2 and gif.info['duration'] == 250
+    with pytest.raises(ValueError):
+        open_writer('anim', format='avi', output_dir=str(tmp_path))
+
+def test_abstract():
+    class Incomplete(FrameWriter):
+        def append(self, frame):
+            pass
+    with pytest.raises(TypeError):
+        Incomplete()